@@ -0,0 +1,189 @@
+"""
+Hardware-free throughput and latency benchmark for the sampling and
+report path. Runs sensors.py, the filter/calibration pipeline and the
+GloveRuntime frame and report steps against sim.FakeSpiDev and a StubBus,
+unthrottled, and reports frames per second, CPU and allocations per
+frame and sample-to-emit latency.
+
+    python bench.py --frames 20000 --json bench.json
+    python bench.py --compare bench.json
+
+Results are deterministic in content (fixed waveform seed) so runs on
+different commits of the same machine can be compared.
+"""
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import sim
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def build(args, profile_dir):
+    """
+    The first configured glove, wired by main.Glove exactly as on the Pi,
+    with every input report subscribed. Its calibration profiles live in
+    profile_dir.
+    """
+    import main
+    from imu import I2C_BUS, MPU6050_ADDRESS
+
+    main.OVERSAMPLE = args.oversample
+    if args.no_change_detect:
+        main.SEND_ON_CHANGE = False
+    main.PROFILE_PATH = os.path.join(profile_dir, "calibration.bin")
+    config = dict(main.GLOVES[0], imu=(I2C_BUS, MPU6050_ADDRESS) if args.imu else None)
+    profiles, = main.open_profiles([config]).values()
+    bus = sim.StubBus()
+    glove = main.Glove(bus, 0, config, profiles)
+    for report in glove.hid_service.input_reports:
+        report.notifying = True
+    if glove.runtime.gestures is not None:
+        # Printing every gesture would swamp the results
+        glove.runtime.gestures.on_event = None
+    return bus, glove
+
+
+def run_frames(runtime, frames, send_every):
+    for i in range(frames):
+        runtime.sample_once()
+        if i % send_every == 0:
+            runtime.send_latest()
+
+
+def measure(args):
+    with tempfile.TemporaryDirectory() as profile_dir:
+        bus, glove = build(args, profile_dir)
+        try:
+            return measure_glove(args, bus, glove)
+        finally:
+            glove.runtime.executor.shutdown()
+            glove.close()
+            glove.profiles.close()
+
+
+def measure_glove(args, bus, glove):
+    runtime = glove.runtime
+    stats = glove.stats
+    send_every = args.send_every
+
+    # Warm up: fills filter state and lets auto-ranging settle
+    run_frames(runtime, args.warmup, send_every)
+    stats.reset()
+    bus.emits = 0
+    bus.bytes = 0
+
+    gc.collect()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    run_frames(runtime, args.frames, send_every)
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+    snapshot = stats.snapshot()["us"]
+    emits, emit_bytes = bus.emits, bus.bytes
+
+    # Separate pass for allocations, tracemalloc slows everything down
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    run_frames(runtime, args.alloc_frames, send_every)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    gc.collect()
+    blocks = sys.getallocatedblocks() - blocks
+
+    return {
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "frames": args.frames,
+        "oversample": args.oversample,
+        "imu": args.imu,
+        "fps": args.frames / wall,
+        "cpu_us_per_frame": cpu * 1e6 / args.frames,
+        "emits": emits,
+        "emit_bytes": emit_bytes,
+        "alloc_peak_bytes": peak - base,
+        "alloc_net_bytes_per_frame": (current - base) / args.alloc_frames,
+        "net_blocks_per_frame": blocks / args.alloc_frames,
+        "stages_us": snapshot,
+    }
+
+
+def flatten(result):
+    flat = {}
+    for key, value in result.items():
+        if key == "stages_us":
+            for stage, summary in value.items():
+                for stat in ("p50", "p99", "max"):
+                    flat[f"{stage}.{stat}_us"] = summary[stat]
+        elif isinstance(value, (int, float)):
+            flat[key] = value
+    return flat
+
+
+def print_result(result, baseline=None):
+    print(f"revision {result['revision']}, python {result['python']}")
+    flat = flatten(result)
+    old = flatten(baseline) if baseline else {}
+    for key, value in flat.items():
+        line = f"  {key:28s} {value:12.2f}"
+        if key in old and old[key]:
+            line += f"  ({(value - old[key]) * 100.0 / old[key]:+.1f}% vs {baseline['revision']})"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--frames", type=int, default=20000)
+    parser.add_argument("--warmup", type=int, default=500)
+    parser.add_argument("--alloc-frames", type=int, default=2000)
+    parser.add_argument("--oversample", type=int, default=None,
+                        help="ADC conversions per channel per frame (default: main.OVERSAMPLE)")
+    parser.add_argument("--send-every", type=int, default=1,
+                        help="run the report sender every N frames")
+    parser.add_argument("--no-change-detect", action="store_true")
+    parser.add_argument("--recording", help="replay raw frames from a recording instead of "
+                                            "the synthetic waveform")
+    parser.add_argument("--imu", action="store_true", help="include the IMU fusion path")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="print change against an earlier --json result")
+    args = parser.parse_args()
+
+    waveform = None
+    motion = None
+    if args.recording:
+        waveform = sim.RecordedWaveform.from_recording(args.recording)
+        if args.imu:
+            motion = sim.RecordedMotion.from_recording(args.recording)
+    sim.install(waveform, motion)
+    if args.oversample is None:
+        import main as glove_main
+        args.oversample = glove_main.OVERSAMPLE
+
+    result = measure(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_result(result, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
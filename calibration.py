@@ -0,0 +1,149 @@
+import math
+from array import array
+
+ADC_BITS = 10
+OUT_MIN = -32768
+OUT_MAX = 32767
+
+DEFAULT_RAW_MIN = 200
+DEFAULT_RAW_MAX = 400
+MIN_SPAN = 8  # raw counts; keeps a barely-moved sensor from scaling to full range
+AUTO_RANGE_REBUILD_FRAMES = 50
+
+
+class Calibration:
+    """
+    Per-channel calibration for the flex sensors.
+
+    raw_min/raw_max are in 10-bit ADC counts, offset is added after scaling
+    (report units) and curve is an exponent applied to the normalised 0–1
+    position. All of it is compiled into one lookup table per channel
+    indexed by the raw ADC value, so scale() is a table lookup per channel
+    with no float math on the hot path.
+
+    With auto_range enabled, observe() widens each channel's range to the
+    extremes actually seen and rebuilds the affected tables at most once
+    every AUTO_RANGE_REBUILD_FRAMES frames, one table per frame, so the
+    sampling loop never pays for the whole hand at once.
+    """
+    def __init__(self, channels=5, raw_min=DEFAULT_RAW_MIN, raw_max=DEFAULT_RAW_MAX,
+                 offset=0, curve=1.0, adc_bits=ADC_BITS):
+        if adc_bits < ADC_BITS:
+            raise ValueError(f"adc_bits must be at least {ADC_BITS}")
+        self.channels = channels
+        self.adc_bits = adc_bits
+        self.size = 1 << adc_bits
+        self.raw_min = array("f", [raw_min] * channels)
+        self.raw_max = array("f", [raw_max] * channels)
+        self.offset = array("l", [offset] * channels)
+        self.curve = array("f", [curve] * channels)
+        self.luts = [array("h", bytes(2 * self.size)) for _ in range(channels)]
+
+        self.auto_range = False
+        self.observed_min = array("f", self.raw_min)
+        self.observed_max = array("f", self.raw_max)
+        self._dirty = set()
+        self._pending = []
+        self._frames_since_rebuild = 0
+        # Channels whose table changed since the profile was last saved
+        self.unsaved = set()
+        self.rebuild()
+
+    def set_channel(self, ch, raw_min=None, raw_max=None, offset=None, curve=None):
+        if raw_min is not None:
+            self.raw_min[ch] = raw_min
+        if raw_max is not None:
+            self.raw_max[ch] = raw_max
+        if offset is not None:
+            self.offset[ch] = offset
+        if curve is not None:
+            self.curve[ch] = curve
+        self.rebuild_channel(ch)
+
+    def rebuild(self):
+        for ch in range(self.channels):
+            self.rebuild_channel(ch)
+
+    def rebuild_channel(self, ch):
+        lut = self.luts[ch]
+        lo = self.raw_min[ch]
+        span = max(self.raw_max[ch] - lo, MIN_SPAN)
+        curve = self.curve[ch]
+        offset = self.offset[ch]
+        scale = 1 << (self.adc_bits - ADC_BITS)
+        step = 1.0 / scale  # LUT index -> 10-bit counts
+        # Outside lo..lo+span the table is flat, so only the indices in
+        # between need the float math; the ends are filled as slices
+        start = min(max(math.floor(lo * scale), 0), self.size)
+        end = min(max(math.ceil((lo + span) * scale) + 1, start), self.size)
+        low = max(OUT_MIN, min(OUT_MAX, -32768 + offset))
+        high = max(OUT_MIN, min(OUT_MAX, 32767 + offset))
+        lut[:start] = array("h", [low]) * start
+        lut[end:] = array("h", [high]) * (self.size - end)
+        for i in range(start, end):
+            t = (i * step - lo) / span
+            if t <= 0.0:
+                t = 0.0
+            elif t >= 1.0:
+                t = 1.0
+            elif curve != 1.0:
+                t = t ** curve
+            value = int(t * 65535 - 32768 + offset)
+            lut[i] = OUT_MIN if value < OUT_MIN else OUT_MAX if value > OUT_MAX else value
+        self._dirty.discard(ch)
+        self.unsaved.add(ch)
+
+    def scale(self, raw, out):
+        """
+        Scale raw ADC values (one per channel) into out, in -32768 - 32767.
+        """
+        luts = self.luts
+        for i in range(self.channels):
+            out[i] = luts[i][raw[i]]
+        return out
+
+    def observe(self, raw):
+        """
+        Track per-channel extremes and refresh calibration from them.
+        Returns True if any table was rebuilt.
+        """
+        step = 1.0 / (1 << (self.adc_bits - ADC_BITS))
+        lo = self.observed_min
+        hi = self.observed_max
+        for i in range(self.channels):
+            value = raw[i] * step
+            if value < lo[i]:
+                lo[i] = value
+                self._dirty.add(i)
+            if value > hi[i]:
+                hi[i] = value
+                self._dirty.add(i)
+
+        if not self._pending:
+            self._frames_since_rebuild += 1
+            if not self._dirty or self._frames_since_rebuild < AUTO_RANGE_REBUILD_FRAMES:
+                return False
+            self._frames_since_rebuild = 0
+            self._pending = sorted(self._dirty, reverse=True)
+        # One channel per frame; the rest of the batch follow on the next frames
+        ch = self._pending.pop()
+        self.raw_min[ch] = lo[ch]
+        self.raw_max[ch] = hi[ch]
+        self.rebuild_channel(ch)
+        return True
+
+    def reset_range(self, keep_current=True):
+        """
+        Restart auto-ranging, either from the current calibration or,
+        with keep_current=False, from nothing so the range is learned
+        purely from the values observed next.
+        """
+        if keep_current:
+            self.observed_min[:] = self.raw_min
+            self.observed_max[:] = self.raw_max
+        else:
+            for ch in range(self.channels):
+                self.observed_min[ch] = float("inf")
+                self.observed_max[ch] = float("-inf")
+        self._dirty.clear()
+        self._pending.clear()
@@ -0,0 +1,56 @@
+import time
+
+
+class ChangeDetector:
+    """
+    Suppresses HID reports that do not differ from the last sent one.
+
+    A report is sent when the button state changes, when any axis moved by
+    more than its deadband, or when keepalive seconds passed since the last
+    send so the host still sees periodic state. A deadband of 0 means
+    "send only on change".
+    """
+    def __init__(self, width=5, deadband=0, keepalive=1.0, clock=time.monotonic):
+        self.width = width
+        if isinstance(deadband, (int, float)):
+            self.deadband = [deadband] * width
+        else:
+            if len(deadband) != width:
+                raise ValueError("deadband needs one value per axis")
+            self.deadband = list(deadband)
+        self.keepalive = keepalive
+        self.clock = clock
+        self.last_axes = [0] * width
+        self.sent = 0
+        self.suppressed = 0
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the last sent report so the next one always goes out.
+        """
+        self.last_button = None
+        self.last_sent = 0.0
+
+    def should_send(self, axes, button=0):
+        now = self.clock()
+        send = (button != self.last_button
+                or (self.keepalive is not None and now - self.last_sent >= self.keepalive))
+        if not send:
+            last = self.last_axes
+            deadband = self.deadband
+            for i in range(self.width):
+                if abs(axes[i] - last[i]) > deadband[i]:
+                    send = True
+                    break
+        if send:
+            self.last_axes[:] = axes
+            self.last_button = button
+            self.last_sent = now
+            self.sent += 1
+        else:
+            self.suppressed += 1
+        return send
+
+    def stats(self):
+        return {"sent": self.sent, "suppressed": self.suppressed}
@@ -0,0 +1,143 @@
+import math
+from array import array
+
+
+class EmaFilter:
+    """
+    Exponential moving average per channel: y += alpha * (x - y).
+    """
+    def __init__(self, channels=5, alpha=0.5):
+        if not 0.0 < alpha <= 1.0:
+            raise ValueError("alpha must be in (0, 1]")
+        self.channels = channels
+        self.alpha = alpha
+        self.state = array("d", [0.0] * channels)
+        self.primed = False
+
+    def reset(self):
+        self.primed = False
+
+    def apply(self, values, timestamp):
+        state = self.state
+        if not self.primed:
+            state[:] = array("d", values)
+            self.primed = True
+            return values
+        alpha = self.alpha
+        for i in range(self.channels):
+            y = state[i] + alpha * (values[i] - state[i])
+            state[i] = y
+            values[i] = y
+        return values
+
+
+class MedianFilter:
+    """
+    Median of the last N samples per channel, to remove single-sample
+    spikes. Adds (N - 1) / 2 samples of delay; N = 3 is usually enough.
+    """
+    def __init__(self, channels=5, window=3):
+        if window < 1 or window % 2 == 0:
+            raise ValueError("window must be a positive odd number")
+        self.channels = channels
+        self.window = window
+        self.history = array("d", [0.0] * (channels * window))
+        self.pos = 0
+        self.primed = False
+
+    def reset(self):
+        self.primed = False
+
+    def apply(self, values, timestamp):
+        n = self.window
+        history = self.history
+        if not self.primed:
+            for i in range(self.channels):
+                for k in range(n):
+                    history[i * n + k] = values[i]
+            self.primed = True
+            return values
+        pos = self.pos
+        mid = n // 2
+        for i in range(self.channels):
+            base = i * n
+            history[base + pos] = values[i]
+            if n == 3:
+                a, b, c = history[base], history[base + 1], history[base + 2]
+                values[i] = max(min(a, b), min(max(a, b), c))
+            else:
+                values[i] = sorted(history[base:base + n])[mid]
+        self.pos = (pos + 1) % n
+        return values
+
+
+class OneEuroFilter:
+    """
+    One Euro filter (Casiez et al.): a low-pass whose cutoff rises with
+    the signal's speed, so slow movement is smoothed heavily while fast
+    movement passes with little lag. min_cutoff (Hz) sets the smoothing at
+    rest, beta how quickly the cutoff opens up with speed (raw counts/s).
+    """
+    def __init__(self, channels=5, min_cutoff=1.0, beta=0.01, d_cutoff=1.0):
+        self.channels = channels
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.x = array("d", [0.0] * channels)
+        self.dx = array("d", [0.0] * channels)
+        self.last_time = None
+
+    def reset(self):
+        self.last_time = None
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        tau = 1.0 / (2.0 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def apply(self, values, timestamp):
+        if self.last_time is None:
+            self.x[:] = array("d", values)
+            for i in range(self.channels):
+                self.dx[i] = 0.0
+            self.last_time = timestamp
+            return values
+        if timestamp <= self.last_time:
+            # No time has passed; repeat the last output
+            for i in range(self.channels):
+                values[i] = self.x[i]
+            return values
+        dt = timestamp - self.last_time
+        self.last_time = timestamp
+        a_d = self._alpha(self.d_cutoff, dt)
+        x = self.x
+        dx = self.dx
+        for i in range(self.channels):
+            d = (values[i] - x[i]) / dt
+            d = dx[i] + a_d * (d - dx[i])
+            dx[i] = d
+            a = self._alpha(self.min_cutoff + self.beta * abs(d), dt)
+            y = x[i] + a * (values[i] - x[i])
+            x[i] = y
+            values[i] = y
+        return values
+
+
+class FilterPipeline:
+    """
+    Runs filters in order over one frame, in place.
+    """
+    def __init__(self, filters=()):
+        self.filters = list(filters)
+
+    def add(self, f):
+        self.filters.append(f)
+
+    def reset(self):
+        for f in self.filters:
+            f.reset()
+
+    def apply(self, values, timestamp):
+        for f in self.filters:
+            f.apply(values, timestamp)
+        return values
@@ -0,0 +1,47 @@
+from array import array
+
+
+class FrameRing:
+    """
+    Fixed-size ring of timestamped frames shared between one producer
+    (the sampler thread) and any number of readers.
+
+    All slots are allocated up front. The producer fills a slot and then
+    publishes it by bumping seq, so readers never take a lock; a reader that
+    was lapped while copying simply retries. Old frames are overwritten,
+    never queued.
+    """
+    def __init__(self, capacity=16, width=5):
+        if capacity < 2:
+            raise ValueError("capacity must be at least 2")
+        self.capacity = capacity
+        self.width = width
+        self.timestamps = array("d", [0.0] * capacity)
+        self.frames = [[0] * width for _ in range(capacity)]
+        self.seq = 0  # total frames written; latest is slot (seq - 1) % capacity
+
+    def write(self, values, timestamp):
+        """
+        Copy values into the next slot and publish it.
+        """
+        seq = self.seq
+        idx = seq % self.capacity
+        self.frames[idx][:] = values
+        self.timestamps[idx] = timestamp
+        self.seq = seq + 1
+
+    def read_latest(self, out):
+        """
+        Copy the newest frame into out (a list of length width).
+        Returns (seq, timestamp), or (0, 0.0) if nothing was written yet.
+        """
+        while True:
+            seq = self.seq
+            if seq == 0:
+                return 0, 0.0
+            idx = (seq - 1) % self.capacity
+            out[:] = self.frames[idx]
+            timestamp = self.timestamps[idx]
+            # The slot is only reused once the producer laps the ring
+            if self.seq - seq < self.capacity - 1:
+                return seq, timestamp
@@ -0,0 +1,102 @@
+"""
+Orientation from accelerometer and gyro batches.
+"""
+import math
+
+STILL_GYRO_DPS = 3.0  # slower than this (and ~1 g) counts as holding still
+STILL_ACCEL_G = 0.05
+
+
+class OrientationFilter:
+    """
+    Mahony-style complementary filter on a quaternion.
+
+    Works on a whole FIFO batch at a time: the gyro rate is averaged over
+    the batch and integrated as one exact rotation over the batch's
+    duration, and the batch's mean acceleration pulls the estimate
+    towards gravity (kp proportional, ki integral to cancel gyro drift).
+    At a few samples per batch the error from treating the rate as
+    constant is far below sensor noise, and the cost per frame no longer
+    depends on the IMU rate.
+
+    Roll and pitch are absolute. Yaw has no magnetometer reference, so it
+    is relative to power-on; a gyro bias learnt while the hand is still
+    keeps its drift down.
+    """
+    def __init__(self, kp=1.0, ki=0.05, bias_rate=0.02):
+        self.kp = kp
+        self.ki = ki
+        self.bias_rate = bias_rate
+        self.reset()
+
+    def reset(self):
+        self.q = [1.0, 0.0, 0.0, 0.0]
+        self.integral = [0.0, 0.0, 0.0]
+        self.bias = [0.0, 0.0, 0.0]
+        self.batches = 0
+
+    def update(self, accel, gyro, dt):
+        """
+        accel: mean acceleration (g), gyro: mean rate (deg/s), both as
+        (x, y, z) over a batch lasting dt seconds.
+        """
+        q0, q1, q2, q3 = self.q
+        gx, gy, gz = gyro
+        ax, ay, az = accel
+        bias = self.bias
+
+        norm = math.sqrt(ax * ax + ay * ay + az * az)
+        if (self.bias_rate and abs(norm - 1.0) < STILL_ACCEL_G
+                and abs(gx) < STILL_GYRO_DPS and abs(gy) < STILL_GYRO_DPS and abs(gz) < STILL_GYRO_DPS):
+            bias[0] += self.bias_rate * (gx - bias[0])
+            bias[1] += self.bias_rate * (gy - bias[1])
+            bias[2] += self.bias_rate * (gz - bias[2])
+        scale = math.pi / 180.0
+        gx = (gx - bias[0]) * scale
+        gy = (gy - bias[1]) * scale
+        gz = (gz - bias[2]) * scale
+
+        if norm > 0.0:
+            ax /= norm
+            ay /= norm
+            az /= norm
+            # Gravity direction predicted by the current orientation
+            vx = 2.0 * (q1 * q3 - q0 * q2)
+            vy = 2.0 * (q0 * q1 + q2 * q3)
+            vz = q0 * q0 - q1 * q1 - q2 * q2 + q3 * q3
+            ex = ay * vz - az * vy
+            ey = az * vx - ax * vz
+            ez = ax * vy - ay * vx
+            integral = self.integral
+            if self.ki > 0.0:
+                integral[0] += self.ki * ex * dt
+                integral[1] += self.ki * ey * dt
+                integral[2] += self.ki * ez * dt
+            gx += self.kp * ex + integral[0]
+            gy += self.kp * ey + integral[1]
+            gz += self.kp * ez + integral[2]
+
+        rate = math.sqrt(gx * gx + gy * gy + gz * gz)
+        if rate > 0.0:
+            half = 0.5 * rate * dt
+            s = math.sin(half) / rate
+            c = math.cos(half)
+            rx, ry, rz = gx * s, gy * s, gz * s
+            q0, q1, q2, q3 = (q0 * c - q1 * rx - q2 * ry - q3 * rz,
+                              q0 * rx + q1 * c + q2 * rz - q3 * ry,
+                              q0 * ry - q1 * rz + q2 * c + q3 * rx,
+                              q0 * rz + q1 * ry - q2 * rx + q3 * c)
+            norm = math.sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+            q0, q1, q2, q3 = q0 / norm, q1 / norm, q2 / norm, q3 / norm
+        self.q[:] = (q0, q1, q2, q3)
+        self.batches += 1
+
+    def euler(self):
+        """
+        (roll, pitch, yaw) in radians.
+        """
+        q0, q1, q2, q3 = self.q
+        roll = math.atan2(2.0 * (q0 * q1 + q2 * q3), 1.0 - 2.0 * (q1 * q1 + q2 * q2))
+        pitch = math.asin(max(-1.0, min(1.0, 2.0 * (q0 * q2 - q3 * q1))))
+        yaw = math.atan2(2.0 * (q0 * q3 + q1 * q2), 1.0 - 2.0 * (q2 * q2 + q3 * q3))
+        return roll, pitch, yaw
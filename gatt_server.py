@@ -1,7 +1,8 @@
 import dbus
 import dbus.service
-import struct
-from hid_descriptor import HID_DESCRIPTOR
+import socket
+import time
+from hid_descriptor import REPORT_LAYOUTS, REPORT_TYPE_INPUT, build_report_map
 
 UUID_HID_SERVICE = "00001812-0000-1000-8000-00805f9b34fb"
 UUID_REPORT_MAP = "00002A4B-0000-1000-8000-00805f9b34fb"
@@ -12,17 +13,77 @@ UUID_PROTO_MODE = "00002A4E-0000-1000-8000-00805f9b34fb"
 UUID_REPORT_REF = "00002908-0000-1000-8000-00805f9b34fb"
 UUID_CCCD = "00002902-0000-1000-8000-00805f9b34fb"
 UUID_PNP_ID = "00002A50-0000-1000-8000-00805f9b34fb"
+UUID_DIAG_SERVICE = "6e4f0001-5a1d-4c3e-9b7a-2f1d8c3e0a10"
+UUID_DIAG_STATS = "6e4f0002-5a1d-4c3e-9b7a-2f1d8c3e0a10"
+
+GATT_SERVICE_IFACE = "org.bluez.GattService1"
+GATT_CHRC_IFACE = "org.bluez.GattCharacteristic1"
+GATT_DESC_IFACE = "org.bluez.GattDescriptor1"
+
+# HID version 1.11, country code 0, flags
+HID_INFORMATION = bytes([0x11, 0x01, 0x00, 0x00])
+# Vendor ID source, vendor ID, product ID, product version
+PNP_ID = bytes([0x01, 0x00, 0x00, 0x01, 0x00, 0x00, 0x01])
+
+# GATT metadata never changes once an object exists, so each object's
+# properties are built once, as fully typed dbus values, and handed out
+# as-is to GetManagedObjects.
+
+def service_properties(uuid, primary=True):
+    return {GATT_SERVICE_IFACE: dbus.Dictionary({"UUID": dbus.String(uuid),
+                                                 "Primary": dbus.Boolean(primary)},
+                                                signature="sv")}
+
+def characteristic_properties(service, uuid, flags, **extra):
+    props = dbus.Dictionary({"Service": service.get_path(),
+                             "UUID": dbus.String(uuid),
+                             "Flags": dbus.Array(flags, signature="s")},
+                            signature="sv")
+    props.update(extra)
+    return {GATT_CHRC_IFACE: props}
+
+def descriptor_properties(characteristic, uuid, flags):
+    return {GATT_DESC_IFACE: dbus.Dictionary({"Characteristic": characteristic.get_path(),
+                                              "UUID": dbus.String(uuid),
+                                              "Flags": dbus.Array(flags, signature="s")},
+                                             signature="sv")}
+
+class ConstantValue:
+    """
+    ReadValue replies for a value that never changes. Long reads arrive
+    as several requests with increasing offsets; each slice is wrapped
+    once and reused.
+    """
+    def __init__(self, value):
+        self.value = bytes(value)
+        self._replies = {}
+
+    def read(self, options):
+        offset = int(options.get("offset", 0))
+        reply = self._replies.get(offset)
+        if reply is None:
+            reply = self._replies[offset] = dbus.ByteArray(self.value[offset:])
+        return reply
 
 class HIDService(dbus.service.Object):
+    """
+    HID over GATT service with one input report characteristic per
+    report layout. The first layout is the primary, high-rate report.
+    """
     PATH_BASE = "/aei/glove/hid/service"
 
-    def __init__(self, bus, index):
+    def __init__(self, bus, index, layouts=REPORT_LAYOUTS):
         self.path = self.PATH_BASE + str(index)
         self.bus = bus
         self.uuid = UUID_HID_SERVICE
         self.primary = True
+        self.layouts = tuple(layouts)
+        self.report_map = build_report_map(self.layouts)
+        self.properties = service_properties(self.uuid, self.primary)
 
-        self.input_report = HIDInputReport(bus, 0, self)
+        self.input_reports = [HIDInputReport(bus, i, self, layout)
+                              for i, layout in enumerate(self.layouts)]
+        self.input_report = self.input_reports[0]
 
         super().__init__(bus, self.path)
 
@@ -32,7 +93,8 @@ class HIDService(dbus.service.Object):
         self.add_characteristic(HIDProtocolMode(bus, 2, self))
         self.add_characteristic(HIDReportMap(bus, 3, self))
         self.add_characteristic(HIDPnPID(bus, 4, self))
-        self.add_characteristic(self.input_report)
+        for report in self.input_reports:
+            self.add_characteristic(report)
 
     def add_characteristic(self, chrc):
         self.characteristics.append(chrc)
@@ -41,7 +103,7 @@ class HIDService(dbus.service.Object):
         return dbus.ObjectPath(self.path)
 
     def get_properties(self):
-        return {"org.bluez.GattService1": {"UUID": self.uuid, "Primary": dbus.Boolean(self.primary)}}
+        return self.properties
 
 # ------------------ HID Characteristics ------------------
 
@@ -51,36 +113,35 @@ class HIDReportMap(dbus.service.Object):
         self.service = service
         self.uuid = UUID_REPORT_MAP
         self.flags = ["read"]
+        self.properties = characteristic_properties(service, self.uuid, self.flags)
+        self.value = ConstantValue(service.report_map)
         super().__init__(bus, self.path)
 
     def get_path(self):
         return dbus.ObjectPath(self.path)
 
     def get_properties(self):
-        return {"org.bluez.GattCharacteristic1": {"Service": self.service.get_path(),
-                                                  "UUID": self.uuid,
-                                                  "Flags": dbus.Array(self.flags, signature="s")}}
+        return self.properties
 
     @dbus.service.method("org.bluez.GattCharacteristic1", in_signature="a{sv}", out_signature="ay")
     def ReadValue(self, options):
-        return dbus.ByteArray(HID_DESCRIPTOR)
+        return self.value.read(options)
 
 class ReportReferenceDescriptor(dbus.service.Object):
-    def __init__(self, bus, index, characteristic):
+    def __init__(self, bus, index, characteristic, report_id, report_type=REPORT_TYPE_INPUT):
         self.path = f"{characteristic.path}/desc{index}"
         self.characteristic = characteristic
         self.uuid = UUID_REPORT_REF
-        self.value = dbus.ByteArray([0x01, 0x01])  # Report ID 1, Input
+        self.value = ConstantValue([report_id, report_type])
+        self.properties = descriptor_properties(characteristic, self.uuid, ["read"])
         super().__init__(bus, self.path)
 
     def get_properties(self):
-        return {"org.bluez.GattDescriptor1": {"Characteristic": self.characteristic.get_path(),
-                                             "UUID": self.uuid,
-                                             "Flags": dbus.Array(["read"], signature="s")}}
+        return self.properties
 
     @dbus.service.method("org.bluez.GattDescriptor1", in_signature="a{sv}", out_signature="ay")
     def ReadValue(self, options):
-        return dbus.ByteArray(self.value)
+        return self.value.read(options)
 
 class ClientCharacteristicConfigurationDescriptor(dbus.service.Object):
     def __init__(self, bus, index, characteristic):
@@ -88,30 +149,58 @@ class ClientCharacteristicConfigurationDescriptor(dbus.service.Object):
         self.characteristic = characteristic
         self.uuid = UUID_CCCD
         self.value = [0x00, 0x00]
+        self.properties = descriptor_properties(characteristic, self.uuid, ["read","write"])
         super().__init__(bus, self.path)
 
     def get_properties(self):
-        return {"org.bluez.GattDescriptor1": {"Characteristic": self.characteristic.get_path(),
-                                             "UUID": self.uuid,
-                                             "Flags": dbus.Array(["read","write"], signature="s")}}
+        return self.properties
 
     @dbus.service.method("org.bluez.GattDescriptor1", in_signature="ay", out_signature="")
     def WriteValue(self, value):
         self.value = list(value)
         notify_enabled = self.value[0] & 0x01
-        self.characteristic.notifying = bool(notify_enabled)
+        self.characteristic.set_notifying(bool(notify_enabled))
         print("Notifications enabled:", self.characteristic.notifying)
 
 class HIDInputReport(dbus.service.Object):
-    def __init__(self, bus, index, service):
-        self.path = f"{service.path}/char{index}"
+    def __init__(self, bus, index, service, layout):
+        self.path = f"{service.path}/char_report{index}"
         self.service = service
+        self.layout = layout
         self.uuid = UUID_REPORT
         self.flags = ["read","notify"]
         self.notifying = False
+        # Minimum seconds between sent reports; None sends every frame
+        self.interval = None
+        self._last_sent = 0.0
+        # Seconds between logged reports; None disables report logging
+        self.log_interval = None
+        self._last_log = 0.0
+        # Optional ChangeDetector; when set, redundant reports are not sent
+        self.change_detector = None
+        # Optional recording.Recorder; gets every report that is sent
+        self.recorder = None
+        # Optional callback(notifying) run when a client subscribes or leaves
+        self.on_notify_changed = None
+        # Use AcquireNotify: reports go over a socket to BlueZ instead of
+        # PropertiesChanged, and a full socket tells us the link is backed up
+        self.acquire_notify = True
+        self._notify_socket = None
+        self.mtu = 23
+        self.congested = 0
+        self.report = bytearray(layout.size)
+        self._changed = {"Value": None}
+        self._invalidated = dbus.Array([], signature="s")
+        # Optional callback() -> (axes, button) giving the newest frame, so
+        # reads return current values rather than the last report sent
+        self.read_frame = None
+        self._read_report = bytearray(layout.size)
+        # BlueZ only checks that NotifyAcquired exists, to offer AcquireNotify
+        extra = {"NotifyAcquired": dbus.Boolean(False)} if self.acquire_notify else {}
+        self.properties = characteristic_properties(service, self.uuid, self.flags, **extra)
         super().__init__(bus, self.path)
 
-        self.report_ref = ReportReferenceDescriptor(bus, 0, self)
+        self.report_ref = ReportReferenceDescriptor(bus, 0, self, layout.report_id)
         self.cccd = ClientCharacteristicConfigurationDescriptor(bus, 0, self)
         self.descriptors = [self.report_ref, self.cccd]
 
@@ -119,36 +208,99 @@ class HIDInputReport(dbus.service.Object):
         return dbus.ObjectPath(self.path)
 
     def get_properties(self):
-        return {"org.bluez.GattCharacteristic1": {"Service": self.service.get_path(),
-                                                  "UUID": self.uuid,
-                                                  "Flags": dbus.Array(self.flags, signature="s")}}
+        return self.properties
 
     def get_descriptors(self):
         return self.descriptors
 
     @dbus.service.method("org.bluez.GattCharacteristic1", in_signature="a{sv}", out_signature="ay")
     def ReadValue(self, options):
-        report = struct.pack("<5h", 0,0,0,0,0)
-        return dbus.ByteArray([0x01]+list(report))  # Report ID + 5 axes
+        if self.read_frame is None:
+            report = self.report
+        else:
+            axes, button = self.read_frame()
+            report = self._read_report
+            self.layout.pack_into(report, axes, button)
+        offset = int(options.get("offset", 0))
+        return dbus.ByteArray(bytes(report[offset:]))
 
     @dbus.service.method("org.bluez.GattCharacteristic1", in_signature="", out_signature="")
     def StartNotify(self):
-        self.notifying = True
+        self.set_notifying(True)
         print("StartNotify called")
 
     @dbus.service.method("org.bluez.GattCharacteristic1", in_signature="", out_signature="")
     def StopNotify(self):
-        self.notifying = False
+        self.set_notifying(False)
+
+    @dbus.service.method("org.bluez.GattCharacteristic1", in_signature="a{sv}", out_signature="hq")
+    def AcquireNotify(self, options):
+        self._close_notify_socket()
+        self.mtu = int(options.get("mtu", 23))
+        ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        ours.setblocking(False)
+        self._notify_socket = ours
+        fd = dbus.types.UnixFd(theirs)  # dbus duplicates the descriptor
+        theirs.close()
+        self.set_notifying(True)
+        print("AcquireNotify called, MTU", self.mtu)
+        return fd, dbus.UInt16(self.mtu)
+
+    def _close_notify_socket(self):
+        if self._notify_socket is not None:
+            self._notify_socket.close()
+            self._notify_socket = None
+
+    def set_notifying(self, notifying):
+        if not notifying:
+            self._close_notify_socket()
+        self.notifying = notifying
+        if notifying and self.change_detector is not None:
+            self.change_detector.reset()
+        if self.on_notify_changed is not None:
+            self.on_notify_changed(notifying)
 
     def send_report(self, axes, button=0):
+        """
+        Send one input report. Returns True if it was handed to BlueZ,
+        False if it was not sent (no subscriber, suppressed as unchanged,
+        or the notify socket was full, which also bumps self.congested).
+        """
         if not self.notifying:
-            return
-        report_id = 0x01
-        # button = 0 (released) or 1 (pressed)
-        report = bytes([button & 0x01]) + struct.pack("<5h", *axes)
-        print("REPORT LENGTH:", len(report), "BYTES:", list(report))
-        self.PropertiesChanged("org.bluez.GattCharacteristic1",
-                       {"Value": dbus.Array([dbus.Byte(b) for b in report], signature="y")}, [])
+            return False
+        if self.interval is not None:
+            now = time.monotonic()
+            if now - self._last_sent < self.interval:
+                return False
+            self._last_sent = now
+        if self.change_detector is not None and not self.change_detector.should_send(axes, button):
+            return False
+        # button is a bitmask, bit 0 is button 1
+        self.layout.pack_into(self.report, axes, button)
+        if self.log_interval is not None:
+            self._log_report()
+        if self._notify_socket is not None:
+            try:
+                self._notify_socket.send(self.report)
+            except BlockingIOError:
+                self.congested += 1
+                return False
+            except OSError:
+                # BlueZ closed its end: the client unsubscribed or the link dropped
+                self.set_notifying(False)
+                return False
+        else:
+            self._changed["Value"] = dbus.ByteArray(self.report)
+            self.PropertiesChanged(GATT_CHRC_IFACE, self._changed, self._invalidated)
+        if self.recorder is not None:
+            self.recorder.write_report(time.monotonic(), self.report)
+        return True
+
+    def _log_report(self):
+        now = time.monotonic()
+        if now - self._last_log >= self.log_interval:
+            self._last_log = now
+            print("REPORT LENGTH:", len(self.report), "BYTES:", list(self.report))
 
     @dbus.service.signal("org.freedesktop.DBus.Properties", signature="sa{sv}as")
     def PropertiesChanged(self, interface, changed, invalidated):
@@ -162,19 +314,19 @@ class HIDInformation(dbus.service.Object):
         self.service = service
         self.uuid = UUID_HID_INFO
         self.flags = ["read"]
+        self.properties = characteristic_properties(service, self.uuid, self.flags)
+        self.value = ConstantValue(HID_INFORMATION)
         super().__init__(bus, self.path)
 
     def get_path(self):
         return dbus.ObjectPath(self.path)
 
     def get_properties(self):
-        return {"org.bluez.GattCharacteristic1": {"Service": self.service.get_path(),
-                                                  "UUID": self.uuid,
-                                                  "Flags": dbus.Array(self.flags, signature="s")}}
+        return self.properties
 
     @dbus.service.method("org.bluez.GattCharacteristic1", in_signature="a{sv}", out_signature="ay")
     def ReadValue(self, options):
-        return dbus.ByteArray([0x11,0x01,0x00,0x00])  # HID ver 1.11, country code 0, flags
+        return self.value.read(options)
 
 class HIDControlPoint(dbus.service.Object):
     def __init__(self, bus, index, service):
@@ -182,15 +334,14 @@ class HIDControlPoint(dbus.service.Object):
         self.service = service
         self.uuid = UUID_HID_CTRL
         self.flags = ["write-without-response"]
+        self.properties = characteristic_properties(service, self.uuid, self.flags)
         super().__init__(bus, self.path)
 
     def get_path(self):
         return dbus.ObjectPath(self.path)
 
     def get_properties(self):
-        return {"org.bluez.GattCharacteristic1": {"Service": self.service.get_path(),
-                                                  "UUID": self.uuid,
-                                                  "Flags": dbus.Array(self.flags, signature="s")}}
+        return self.properties
 
     @dbus.service.method("org.bluez.GattCharacteristic1", in_signature="ay", out_signature="")
     def WriteValue(self, value):
@@ -203,23 +354,24 @@ class HIDProtocolMode(dbus.service.Object):
         self.uuid = UUID_PROTO_MODE
         self.flags = ["read","write-without-response"]
         self.mode = 1
+        self.properties = characteristic_properties(service, self.uuid, self.flags)
+        self._mode_reply = dbus.ByteArray([self.mode])
         super().__init__(bus, self.path)
 
     def get_path(self):
         return dbus.ObjectPath(self.path)
 
     def get_properties(self):
-        return {"org.bluez.GattCharacteristic1": {"Service": self.service.get_path(),
-                                                  "UUID": self.uuid,
-                                                  "Flags": dbus.Array(self.flags, signature="s")}}
+        return self.properties
 
     @dbus.service.method("org.bluez.GattCharacteristic1", in_signature="a{sv}", out_signature="ay")
     def ReadValue(self, options):
-        return dbus.ByteArray([self.mode])
+        return self._mode_reply
 
     @dbus.service.method("org.bluez.GattCharacteristic1", in_signature="ay", out_signature="")
     def WriteValue(self, value):
         self.mode = value[0]
+        self._mode_reply = dbus.ByteArray([self.mode])
         print("Protocol Mode set to", self.mode)
 
 class HIDPnPID(dbus.service.Object):
@@ -228,16 +380,71 @@ class HIDPnPID(dbus.service.Object):
         self.service = service
         self.uuid = UUID_PNP_ID
         self.flags = ["read"]
+        self.properties = characteristic_properties(service, self.uuid, self.flags)
+        self.value = ConstantValue(PNP_ID)
+        super().__init__(bus, self.path)
+
+    def get_path(self):
+        return dbus.ObjectPath(self.path)
+
+    def get_properties(self):
+        return self.properties
+
+    @dbus.service.method("org.bluez.GattCharacteristic1", in_signature="a{sv}", out_signature="ay")
+    def ReadValue(self, options):
+        return self.value.read(options)
+
+# ------------------ Diagnostics ------------------
+
+class DiagnosticsService(dbus.service.Object):
+    """
+    Vendor service exposing pipeline timing statistics so lag can be
+    diagnosed from a host without logging in to the Pi.
+    """
+    PATH_BASE = "/aei/glove/hid/service"
+
+    def __init__(self, bus, index, read_stats):
+        self.path = self.PATH_BASE + str(index)
+        self.bus = bus
+        self.uuid = UUID_DIAG_SERVICE
+        self.primary = True
+        self.properties = service_properties(self.uuid, self.primary)
+        super().__init__(bus, self.path)
+
+        self.characteristics = [DiagnosticsCharacteristic(bus, 0, self, read_stats)]
+
+    def get_path(self):
+        return dbus.ObjectPath(self.path)
+
+    def get_properties(self):
+        return self.properties
+
+class DiagnosticsCharacteristic(dbus.service.Object):
+    """
+    Read-only JSON snapshot of per-stage p50/p99/max latency (us) and frame rate.
+    """
+    def __init__(self, bus, index, service, read_stats):
+        self.path = f"{service.path}/char_diag{index}"
+        self.service = service
+        self.uuid = UUID_DIAG_STATS
+        self.flags = ["read"]
+        self.read_stats = read_stats
+        self._snapshot = b""
+        self.properties = characteristic_properties(service, self.uuid, self.flags)
         super().__init__(bus, self.path)
 
     def get_path(self):
         return dbus.ObjectPath(self.path)
 
     def get_properties(self):
-        return {"org.bluez.GattCharacteristic1": {"Service": self.service.get_path(),
-                                                  "UUID": self.uuid,
-                                                  "Flags": dbus.Array(self.flags, signature="s")}}
+        return self.properties
 
     @dbus.service.method("org.bluez.GattCharacteristic1", in_signature="a{sv}", out_signature="ay")
     def ReadValue(self, options):
-        return dbus.ByteArray([0x01,0x00,0x00,0x01,0x00,0x00,0x01])
+        # Long reads arrive as several requests with increasing offsets;
+        # the first takes the snapshot and the rest are cut from it, so
+        # the pieces fit together into one valid JSON document
+        offset = int(options.get("offset", 0))
+        if offset == 0 or not self._snapshot:
+            self._snapshot = self.read_stats()
+        return dbus.ByteArray(self._snapshot[offset:])
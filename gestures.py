@@ -0,0 +1,124 @@
+"""
+Finger-pose gestures mapped to HID buttons.
+
+Each finger is curled or straight, decided by a per-finger threshold with
+hysteresis on its scaled axis (higher values mean more bent). The five
+finger states form a 5-bit pose, and a table built once from the gesture
+templates maps every possible pose to its button bits. Per frame this is
+five comparisons and one list index, whatever the number of gestures.
+"""
+
+CURLED = "C"
+STRAIGHT = "S"
+ANY = "."
+
+# (name, pattern over thumb..pinky, button number)
+DEFAULT_GESTURES = (
+    ("fist", "CCCCC", 1),
+    ("pinch", "CCSSS", 2),
+    ("point", "CSCCC", 3),
+    ("victory", "CSSCC", 4),
+)
+
+
+def parse_pattern(pattern):
+    """
+    Turn a pattern such as "CS..." into (curled mask, straight mask).
+    """
+    curled = straight = 0
+    for i, c in enumerate(pattern):
+        if c == CURLED:
+            curled |= 1 << i
+        elif c == STRAIGHT:
+            straight |= 1 << i
+        elif c != ANY:
+            raise ValueError(f"Bad gesture pattern {pattern!r}")
+    return curled, straight
+
+
+def build_pose_table(gestures, fingers=5):
+    """
+    Button bits for every pose, indexed by the curled-finger bitmask.
+    Poses matching several gestures press all of their buttons.
+    """
+    table = [0] * (1 << fingers)
+    for name, pattern, button in gestures:
+        if len(pattern) != fingers:
+            raise ValueError(f"Gesture {name} needs one pattern character per finger")
+        curled, straight = parse_pattern(pattern)
+        for pose in range(len(table)):
+            if pose & curled == curled and not pose & straight:
+                table[pose] |= 1 << (button - 1)
+    return table
+
+
+class GestureEngine:
+    """
+    Classifies each frame's axes into a pose and returns the HID button
+    bitmask. A new button state has to hold for hold_frames frames before
+    it is reported, so a finger passing through a pose on its way
+    somewhere else doesn't click. on_event(name, pressed) is called on
+    every press and release.
+    """
+    def __init__(self, fingers=5, curl_on=12000, curl_off=4000, gestures=DEFAULT_GESTURES,
+                 hold_frames=3):
+        self.fingers = fingers
+        self.curl_on = self._per_finger(curl_on)
+        self.curl_off = self._per_finger(curl_off)
+        for on, off in zip(self.curl_on, self.curl_off):
+            if off > on:
+                raise ValueError("curl_off must not be above curl_on")
+        self.gestures = tuple(gestures)
+        self.table = build_pose_table(self.gestures, fingers)
+        self.names = {1 << (button - 1): name for name, _, button in self.gestures}
+        self.hold_frames = hold_frames
+        self.on_event = None
+        self.events = 0
+        self.reset()
+
+    def _per_finger(self, value):
+        if isinstance(value, (int, float)):
+            return [value] * self.fingers
+        if len(value) != self.fingers:
+            raise ValueError("Threshold needs one value per finger")
+        return list(value)
+
+    def reset(self):
+        self.pose = 0
+        self.buttons = 0
+        self._candidate = 0
+        self._held = 0
+
+    def update(self, axes):
+        pose = self.pose
+        on = self.curl_on
+        off = self.curl_off
+        for i in range(self.fingers):
+            bit = 1 << i
+            if pose & bit:
+                if axes[i] < off[i]:
+                    pose &= ~bit
+            elif axes[i] > on[i]:
+                pose |= bit
+        self.pose = pose
+
+        buttons = self.table[pose]
+        if buttons != self._candidate:
+            # This frame is the first of the new state's hold
+            self._candidate = buttons
+            self._held = 1
+        elif self._held < self.hold_frames:
+            self._held += 1
+        if buttons != self.buttons and self._held >= self.hold_frames:
+            changed = buttons ^ self.buttons
+            self.buttons = buttons
+            self.events += bin(changed).count("1")
+            if self.on_event is not None:
+                self._emit(changed, buttons)
+        return self.buttons
+
+    def _emit(self, changed, buttons):
+        while changed:
+            bit = changed & -changed
+            changed ^= bit
+            self.on_event(self.names.get(bit, str(bit)), bool(buttons & bit))
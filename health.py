@@ -0,0 +1,132 @@
+"""
+Per-channel sensor health, judged from the raw ADC values.
+
+A flex sensor sits in a divider, so a live one never reads exactly at a
+rail: an open sensor (broken trace, unplugged lead) is pulled to 0 and
+a shorted one to full scale. A reading that does not move by a single
+count for a long time means a dead channel even when it is mid-range,
+since a live sensor always carries some ADC noise.
+"""
+OK = "ok"
+DISCONNECTED = "disconnected"  # at the low rail
+SATURATED = "saturated"  # at the high rail
+STUCK = "stuck"  # not a single count of change for stuck_frames
+
+
+class BusFault(OSError):
+    """
+    Every channel of one ADC read the same rail at once. That is the bus
+    or the chip (MISO stuck high or low), not the sensors.
+    """
+
+
+class ChannelHealth:
+    """
+    Tracks each channel of a sampler and repairs its frames.
+
+    check() is called on every raw frame and returns a repaired copy
+    (the same list every call), leaving raw as the ADC read it so
+    recordings keep the fault. A value at a rail is replaced
+    by the channel's last good value straight away, so a glitch never
+    reaches calibration (auto-range would learn the rail) or the host;
+    after fault_frames in a row the channel is marked faulty. A faulty
+    channel keeps being held until it has read sensibly for
+    recover_frames in a row. groups are the (start, end) index ranges of
+    the ADCs making up the frame; if a whole group reads one rail,
+    check() raises BusFault instead.
+
+    faults counts how often each channel went faulty; states is the
+    current state per channel.
+    """
+    def __init__(self, channels, resolution_bits=10, groups=None, rail_margin=1,
+                 fault_frames=3, stuck_frames=500, recover_frames=10):
+        self.channels = channels
+        extra_bits = max(0, resolution_bits - 10)
+        # rail_margin is in 10-bit counts, like the rest of the config
+        margin = rail_margin << extra_bits
+        self.low = margin
+        self.high = (1 << resolution_bits) - 1 - margin
+        self.groups = list(groups) if groups else [(0, channels)]
+        self.fault_frames = fault_frames
+        self.stuck_frames = stuck_frames
+        self.recover_frames = recover_frames
+        self.good = [None] * channels
+        self.previous = [None] * channels
+        self.states = [OK] * channels
+        self.faults = [0] * channels
+        self.held = 0
+        self.bus_faults = 0
+        self._rail_run = [0] * channels
+        self._same_run = [0] * channels
+        self._good_run = [0] * channels
+        self.repaired = [0] * channels
+
+    def check(self, raw):
+        low = self.low
+        high = self.high
+        for start, end in self.groups:
+            if end - start < 2 or low < raw[start] < high:
+                continue
+            values = raw[start:end]
+            if max(values) <= low or min(values) >= high:
+                self.bus_faults += 1
+                raise BusFault(f"ADC channels {start}-{end - 1} all at a rail: {values}")
+
+        states = self.states
+        good = self.good
+        previous = self.previous
+        rail_run = self._rail_run
+        same_run = self._same_run
+        good_run = self._good_run
+        out = self.repaired
+        out[:] = raw
+        for i in range(self.channels):
+            v = raw[i]
+            same_run[i] = same_run[i] + 1 if v == previous[i] else 0
+            previous[i] = v
+            if v <= low or v >= high:
+                good_run[i] = 0
+                rail_run[i] += 1
+                if rail_run[i] >= self.fault_frames:
+                    self._set_state(i, DISCONNECTED if v <= low else SATURATED)
+                if good[i] is not None:
+                    out[i] = good[i]
+                    self.held += 1
+                continue
+            rail_run[i] = 0
+            state = states[i]
+            if state is not OK and state is not STUCK:
+                # Faulty: keep holding until the channel has settled
+                good_run[i] += 1
+                if good_run[i] >= self.recover_frames:
+                    self._set_state(i, OK)
+                elif good[i] is not None:
+                    out[i] = good[i]
+                    self.held += 1
+                    continue
+            good[i] = v
+            if same_run[i] >= self.stuck_frames:
+                self._set_state(i, STUCK)
+            elif state is STUCK and same_run[i] == 0:
+                self._set_state(i, OK)
+        return out
+
+    def _set_state(self, channel, state):
+        old = self.states[channel]
+        if old is state:
+            return
+        self.states[channel] = state
+        if state is not OK:
+            self.faults[channel] += 1
+        print(f"Channel {channel}: {old} -> {state}")
+
+    def healthy(self):
+        return all(state is OK for state in self.states)
+
+    def snapshot(self):
+        return {
+            "states": list(self.states),
+            "faults": list(self.faults),
+            "held": self.held,
+            "bus_faults": self.bus_faults,
+        }
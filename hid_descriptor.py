@@ -1,36 +1,232 @@
-HID_DESCRIPTOR = bytes([
-    0x05, 0x01,        # Usage Page (Generic Desktop)
-    0x09, 0x04,        # Usage (Joystick)
-    0xA1, 0x01,        # Collection (Application)
-        0x85, 0x01,    # Report ID 1
-
-        0xA1, 0x00,    #Collection(Physical)
-            # --- 1 button ---
-            0x05, 0x09,    # Usage Page (Button)
-            0x19, 0x01,    # Usage Minimum (Button 1)
-            0x29, 0x01,    # Usage Maximum (Button 1)
-            0x15, 0x00,    # Logical Minimum 0
-            0x25, 0x01,    # Logical Maximum 1
-            0x75, 0x01,    # Report Size: 1 bit
-            0x95, 0x01,    # Report Count: 1
-            0x81, 0x02,    # Input (Data,Var,Abs)
-            0x75, 0x07,    # Padding 7 bits
-            0x95, 0x01,
-            0x81, 0x03,    # Input (Const,Var,Abs) - padding
-
-            # --- 5 axes, 16-bit each ---
-            0x05, 0x01,        # Usage Page (Generic Desktop)
-            0x16, 0x00, 0x80,  # Logical Min: -32768
-            0x26, 0xFF, 0x7F,  # Logical Max: 32767
-            0x75, 0x10,        # Report Size: 16 bits
-            0x95, 0x05,        # Report Count: 5 axes
-            0x09, 0x30,        # Usage X
-            0x09, 0x31,        # Usage Y
-            0x09, 0x32,        # Usage Z
-            0x09, 0x33,        # Usage Rx
-            0x09, 0x34,        # Usage Ry
-            0x81, 0x02,        # Input (Data,Var,Abs)
-
-        0xC0,               # End Collection
-    0xC0               # End Collection
-])
+"""
+HID report layouts and the report map built from them.
+
+Each ReportLayout is a declarative list of fields (buttons, axes,
+padding). The same layout produces its section of the report map and
+packs reports, so the descriptor the host parses and the bytes we send
+can't drift apart. Every layout gets its own Joystick application
+collection, which the host exposes as a separate input device.
+"""
+import struct
+
+from calibration import OUT_MIN, OUT_MAX
+
+PIPELINE_BITS = 16  # axis values from the pipeline span OUT_MIN..OUT_MAX
+
+AXIS_USAGES = {"X": 0x30, "Y": 0x31, "Z": 0x32, "Rx": 0x33, "Ry": 0x34, "Rz": 0x35,
+               "Slider": 0x36, "Dial": 0x37, "Wheel": 0x38,
+               "Vx": 0x40, "Vy": 0x41, "Vz": 0x42, "Vbrx": 0x43, "Vbry": 0x44, "Vbrz": 0x45}
+# Usages handed out to a glove's axes, in order
+AXIS_ORDER = ("X", "Y", "Z", "Rx", "Ry", "Rz", "Slider", "Dial", "Wheel",
+              "Vx", "Vy", "Vz", "Vbrx", "Vbry", "Vbrz")
+FLEX_AXES = AXIS_ORDER[:5]
+EXTRA_AXES = 3  # roll, pitch and yaw slots in the full report
+
+# Short item prefixes, combined with the payload size code
+USAGE_PAGE = 0x04
+USAGE = 0x08
+USAGE_MIN = 0x18
+USAGE_MAX = 0x28
+LOGICAL_MIN = 0x14
+LOGICAL_MAX = 0x24
+REPORT_SIZE = 0x74
+REPORT_ID = 0x84
+REPORT_COUNT = 0x94
+INPUT = 0x80
+COLLECTION = 0xA0
+END_COLLECTION = 0xC0
+
+PAGE_GENERIC_DESKTOP = 0x01
+PAGE_BUTTON = 0x09
+USAGE_JOYSTICK = 0x04
+COLLECTION_PHYSICAL = 0x00
+COLLECTION_APPLICATION = 0x01
+INPUT_DATA_VAR_ABS = 0x02
+INPUT_CONST_VAR_ABS = 0x03
+
+REPORT_TYPE_INPUT = 1  # Report Reference descriptor report type
+
+
+def item(prefix, value=None, signed=False):
+    """
+    Encode one short item with the smallest payload that holds value.
+    """
+    if value is None:
+        return bytes([prefix])
+    for size, code in ((1, 1), (2, 2), (4, 3)):
+        try:
+            payload = value.to_bytes(size, "little", signed=signed)
+        except OverflowError:
+            continue
+        return bytes([prefix | code]) + payload
+    raise ValueError(f"HID item value out of range: {value}")
+
+
+class Buttons:
+    def __init__(self, count):
+        self.count = count
+        self.bits = count
+
+    def descriptor(self):
+        return (item(USAGE_PAGE, PAGE_BUTTON)
+                + item(USAGE_MIN, 1) + item(USAGE_MAX, self.count)
+                + item(LOGICAL_MIN, 0) + item(LOGICAL_MAX, 1)
+                + item(REPORT_SIZE, 1) + item(REPORT_COUNT, self.count)
+                + item(INPUT, INPUT_DATA_VAR_ABS))
+
+
+class Axes:
+    """
+    Signed axes of the given width. Pipeline values are 16-bit and are
+    reduced to bits by dropping low bits, so a 10-bit axis carries the
+    ADC's native resolution.
+    """
+    def __init__(self, usages, bits=16):
+        if not 1 < bits <= PIPELINE_BITS:
+            raise ValueError(f"Axis width must be 2..{PIPELINE_BITS} bits")
+        self.usages = tuple(usages)
+        self.count = len(self.usages)
+        self.size = bits
+        self.bits = bits * self.count
+        self.shift = PIPELINE_BITS - bits
+        self.logical_min = OUT_MIN >> self.shift
+        self.logical_max = OUT_MAX >> self.shift
+
+    def descriptor(self):
+        usages = b"".join(item(USAGE, AXIS_USAGES[u]) for u in self.usages)
+        return (item(USAGE_PAGE, PAGE_GENERIC_DESKTOP)
+                + item(LOGICAL_MIN, self.logical_min, signed=True)
+                + item(LOGICAL_MAX, self.logical_max, signed=True)
+                + item(REPORT_SIZE, self.size) + item(REPORT_COUNT, self.count)
+                + usages + item(INPUT, INPUT_DATA_VAR_ABS))
+
+
+class Padding:
+    def __init__(self, bits):
+        self.bits = bits
+
+    def descriptor(self):
+        return item(REPORT_SIZE, self.bits) + item(REPORT_COUNT, 1) + item(INPUT, INPUT_CONST_VAR_ABS)
+
+
+class ReportLayout:
+    """
+    One input report: a report ID and its fields, in wire order (least
+    significant bit first, as HID packs them). Padding to a whole byte is
+    added at the end automatically.
+
+    pack_into() takes the pipeline's axes (16-bit) and a button bitmask.
+    Axes the layout has beyond those given are reported centred.
+    """
+    def __init__(self, report_id, fields, name=""):
+        self.report_id = report_id
+        self.name = name
+        self.fields = list(fields)
+        bits = sum(f.bits for f in self.fields)
+        if bits % 8:
+            self.fields.append(Padding(8 - bits % 8))
+            bits += 8 - bits % 8
+        self.size = bits // 8
+        self.axis_count = sum(f.count for f in self.fields if isinstance(f, Axes))
+        self._struct = self._compile_struct()
+        self._plan = self._compile_plan()
+
+    def _compile_struct(self):
+        """
+        A struct for layouts whose fields all sit on byte boundaries,
+        which packs faster than shifting bits together.
+        """
+        fmt = "<"
+        for f in self.fields:
+            if isinstance(f, Buttons) and f.count == 8:
+                fmt += "B"
+            elif isinstance(f, Axes) and f.size == 16:
+                fmt += f"{f.count}h"
+            elif isinstance(f, Padding) and f.bits % 8 == 0:
+                fmt += f"{f.bits // 8}x"
+            else:
+                return None
+        return struct.Struct(fmt)
+
+    def _compile_plan(self):
+        """
+        (kind, bit offset, shift, mask) per value, for the bit packer.
+        """
+        plan = []
+        offset = 0
+        for f in self.fields:
+            if isinstance(f, Buttons):
+                plan.append(("buttons", offset, 0, (1 << f.count) - 1))
+            elif isinstance(f, Axes):
+                for i in range(f.count):
+                    plan.append(("axis", offset + i * f.size, f.shift, (1 << f.size) - 1))
+            offset += f.bits
+        return plan
+
+    def descriptor(self):
+        body = b"".join(f.descriptor() for f in self.fields)
+        return (item(USAGE_PAGE, PAGE_GENERIC_DESKTOP) + item(USAGE, USAGE_JOYSTICK)
+                + item(COLLECTION, COLLECTION_APPLICATION) + item(REPORT_ID, self.report_id)
+                + item(COLLECTION, COLLECTION_PHYSICAL) + body
+                + item(END_COLLECTION) + item(END_COLLECTION))
+
+    def pack_into(self, buffer, axes, button=0):
+        if len(axes) < self.axis_count:
+            axes = list(axes) + [0] * (self.axis_count - len(axes))
+        if self._struct is not None:
+            self._struct.pack_into(buffer, 0, button & 0xFF, *axes[:self.axis_count])
+            return
+        value = 0
+        axis = 0
+        for kind, offset, shift, mask in self._plan:
+            if kind == "buttons":
+                value |= (button & mask) << offset
+            else:
+                value |= ((axes[axis] >> shift) & mask) << offset
+                axis += 1
+        buffer[:self.size] = value.to_bytes(self.size, "little")
+
+    def unpack(self, data):
+        """
+        Decode a packed report back to (button, axes), axes in report units.
+        """
+        value = int.from_bytes(data[:self.size], "little")
+        button = 0
+        axes = []
+        for kind, offset, shift, mask in self._plan:
+            field = (value >> offset) & mask
+            if kind == "buttons":
+                button = field
+            else:
+                sign = (mask + 1) >> 1
+                axes.append((field ^ sign) - sign)
+        return button, axes
+
+
+def build_report_map(layouts):
+    ids = [layout.report_id for layout in layouts]
+    if len(set(ids)) != len(ids):
+        raise ValueError("Report IDs must be unique")
+    return b"".join(layout.descriptor() for layout in layouts)
+
+
+def glove_layouts(flex_axes=5):
+    """
+    The compact and full report layouts for a glove with this many flex
+    channels.
+
+    compact (ID 1) is the high-rate path: 4 gesture buttons and the flex
+    axes at the ADC's native 10 bits, 7 bytes for five fingers. full
+    (ID 2) has 8 buttons, the flex axes at 16 bits and EXTRA_AXES more
+    (roll, pitch and yaw when an IMU is fitted).
+    """
+    if flex_axes + EXTRA_AXES > len(AXIS_ORDER):
+        raise ValueError(f"At most {len(AXIS_ORDER) - EXTRA_AXES} flex axes per glove")
+    compact = ReportLayout(1, (Buttons(4), Axes(AXIS_ORDER[:flex_axes], 10)), "compact")
+    full = ReportLayout(2, (Buttons(8), Axes(AXIS_ORDER[:flex_axes + EXTRA_AXES], 16)), "full")
+    return compact, full
+
+
+COMPACT_REPORT, FULL_REPORT = glove_layouts(len(FLEX_AXES))
+REPORT_LAYOUTS = (COMPACT_REPORT, FULL_REPORT)
+HID_DESCRIPTOR = build_report_map(REPORT_LAYOUTS)
@@ -0,0 +1,118 @@
+"""
+MPU-6050 family IMU (MPU-6050, MPU-6500, MPU-9250 accel/gyro) on I2C.
+
+The IMU samples into its own FIFO at a fixed rate; once per frame we read
+the FIFO count and then drain every whole sample in a single I2C burst,
+instead of polling six registers per sample. Needs smbus2, which is only
+imported when an IMU is configured.
+"""
+import struct
+
+I2C_BUS = 1
+MPU6050_ADDRESS = 0x68
+
+SMPLRT_DIV = 0x19
+CONFIG = 0x1A
+GYRO_CONFIG = 0x1B
+ACCEL_CONFIG = 0x1C
+FIFO_EN = 0x23
+USER_CTRL = 0x6A
+PWR_MGMT_1 = 0x6B
+FIFO_COUNT_H = 0x72
+FIFO_R_W = 0x74
+WHO_AM_I = 0x75
+
+CLOCK_PLL_XGYRO = 0x01
+DLPF_44HZ = 0x03  # 1 kHz internal rate, ~44 Hz bandwidth
+FIFO_EN_ACCEL_GYRO = 0x78  # XG, YG, ZG and accel
+USER_CTRL_FIFO_EN = 0x40
+USER_CTRL_FIFO_RESET = 0x04
+INTERNAL_RATE_HZ = 1000
+FIFO_SIZE = 1024
+
+# One FIFO sample: accel x, y, z then gyro x, y, z, big-endian
+SAMPLE = struct.Struct(">6h")
+# full scale -> (config bits, LSB per unit); accel in g, gyro in deg/s
+ACCEL_RANGES = {2: (0x00, 16384.0), 4: (0x08, 8192.0), 8: (0x10, 4096.0), 16: (0x18, 2048.0)}
+GYRO_RANGES = {250: (0x00, 131.0), 500: (0x08, 65.5), 1000: (0x10, 32.8), 2000: (0x18, 16.4)}
+
+
+class Mpu6050:
+    """
+    Long-lived handle on the IMU with its FIFO running.
+
+    read_fifo() returns the raw bytes of every whole sample waiting,
+    SAMPLE.size bytes each. If the FIFO overflowed its contents are no
+    longer sample-aligned, so it is reset, the batch dropped and
+    overflows counted.
+    """
+    def __init__(self, bus=I2C_BUS, address=MPU6050_ADDRESS, rate_hz=200,
+                 accel_range=4, gyro_range=500):
+        from smbus2 import SMBus, i2c_msg
+        if accel_range not in ACCEL_RANGES or gyro_range not in GYRO_RANGES:
+            raise ValueError("Unsupported accel or gyro range")
+        self.i2c_msg = i2c_msg
+        self._smbus = SMBus
+        self.bus_number = bus
+        self.bus = SMBus(bus)
+        self.address = address
+        self.divider = max(0, min(255, round(INTERNAL_RATE_HZ / rate_hz) - 1))
+        self.rate_hz = INTERNAL_RATE_HZ / (self.divider + 1)
+        self.accel_bits, self.accel_lsb = ACCEL_RANGES[accel_range]
+        self.gyro_bits, self.gyro_lsb = GYRO_RANGES[gyro_range]
+        self.overflows = 0
+        # The count query never changes, so its messages are built once
+        self._count_select = i2c_msg.write(address, [FIFO_COUNT_H])
+        self._count_read = i2c_msg.read(address, 2)
+        self._fifo_select = i2c_msg.write(address, [FIFO_R_W])
+        self._configure()
+
+    def _configure(self):
+        self._write(PWR_MGMT_1, CLOCK_PLL_XGYRO)
+        self._write(CONFIG, DLPF_44HZ)
+        self._write(SMPLRT_DIV, self.divider)
+        self._write(ACCEL_CONFIG, self.accel_bits)
+        self._write(GYRO_CONFIG, self.gyro_bits)
+        self._write(FIFO_EN, FIFO_EN_ACCEL_GYRO)
+        self.reset_fifo()
+
+    def _write(self, register, value):
+        self.bus.i2c_rdwr(self.i2c_msg.write(self.address, [register, value]))
+
+    def reset_fifo(self):
+        self._write(USER_CTRL, USER_CTRL_FIFO_RESET)
+        self._write(USER_CTRL, USER_CTRL_FIFO_EN)
+
+    def fifo_count(self):
+        self.bus.i2c_rdwr(self._count_select, self._count_read)
+        high, low = bytes(self._count_read)
+        return (high << 8) | low
+
+    def read_fifo(self):
+        count = self.fifo_count()
+        if count >= FIFO_SIZE:
+            self.overflows += 1
+            self.reset_fifo()
+            return b""
+        count -= count % SAMPLE.size
+        if not count:
+            return b""
+        burst = self.i2c_msg.read(self.address, count)
+        self.bus.i2c_rdwr(self._fifo_select, burst)
+        return bytes(burst)
+
+    def reopen(self):
+        """
+        Reopen the I2C bus and configure the IMU again, to recover from
+        bus errors or a chip that was reset by a brownout.
+        """
+        try:
+            self.bus.close()
+        except OSError:
+            pass
+        self.bus = self._smbus(self.bus_number)
+        self._configure()
+
+    def close(self):
+        self._write(USER_CTRL, 0)
+        self.bus.close()
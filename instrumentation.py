@@ -0,0 +1,146 @@
+import json
+import time
+from array import array
+
+# Log-linear buckets over microseconds: exact below 8 us, then 4 buckets
+# per power of two. 72 buckets reach about half a second; slower samples
+# land in the last bucket.
+SUB_BUCKETS = 4
+NUM_BUCKETS = 72
+
+
+def bucket_index(us):
+    if us < 2 * SUB_BUCKETS:
+        return us if us > 0 else 0
+    shift = us.bit_length() - 3
+    idx = shift * SUB_BUCKETS + (us >> shift)
+    return idx if idx < NUM_BUCKETS else NUM_BUCKETS - 1
+
+
+def bucket_bounds(idx):
+    """
+    Return the [low, high) range in microseconds covered by a bucket.
+    """
+    if idx < 2 * SUB_BUCKETS:
+        return idx, idx + 1
+    shift = idx // SUB_BUCKETS - 1
+    low = (idx % SUB_BUCKETS + SUB_BUCKETS) << shift
+    return low, low + (1 << shift)
+
+
+class Histogram:
+    """
+    Fixed-size latency histogram. record() is a bucket increment, so it
+    is cheap enough to call several times per frame.
+    """
+    def __init__(self):
+        self.buckets = array("L", [0] * NUM_BUCKETS)
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+
+    def record(self, ns):
+        us = ns // 1000
+        self.buckets[bucket_index(us)] += 1
+        self.count += 1
+        self.total_us += us
+        if us > self.max_us:
+            self.max_us = us
+
+    def percentile(self, p):
+        """
+        Upper bound, in microseconds, of the bucket holding the p-th
+        percentile (0-100).
+        """
+        if self.count == 0:
+            return 0
+        target = self.count * p / 100.0
+        seen = 0
+        for idx, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= target:
+                return min(bucket_bounds(idx)[1], self.max_us)
+        return self.max_us
+
+    def reset(self):
+        for i in range(NUM_BUCKETS):
+            self.buckets[i] = 0
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+
+    def summary(self):
+        return {
+            "n": self.count,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": self.max_us,
+        }
+
+
+class Instrumentation:
+    """
+    Per-stage timing for the hot path. Stages are looked up by name once
+    and then fed perf_counter_ns() deltas:
+
+        t0 = time.perf_counter_ns()
+        ...
+        stats.record("adc", t0)
+
+    frame() counts completed frames for the frame rate. sections maps
+    extra snapshot keys to callables returning JSON-able values, for
+    counters that live elsewhere.
+    """
+    def __init__(self, stages=()):
+        self.stages = {name: Histogram() for name in stages}
+        self.sections = {}
+        self.frames = 0
+        self.started = time.monotonic()
+
+    def stage(self, name):
+        hist = self.stages.get(name)
+        if hist is None:
+            hist = self.stages[name] = Histogram()
+        return hist
+
+    def record(self, name, start_ns):
+        """
+        Record the time since start_ns for a stage and return now, so
+        consecutive stages can be chained.
+        """
+        now = time.perf_counter_ns()
+        self.stage(name).record(now - start_ns)
+        return now
+
+    def frame(self):
+        self.frames += 1
+
+    def frame_rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.frames / elapsed if elapsed > 0 else 0.0
+
+    def reset(self):
+        for hist in self.stages.values():
+            hist.reset()
+        self.frames = 0
+        self.started = time.monotonic()
+
+    def snapshot(self):
+        snapshot = {
+            "fps": round(self.frame_rate(), 1),
+            "frames": self.frames,
+            "us": {name: hist.summary() for name, hist in self.stages.items()},
+        }
+        for name, read in self.sections.items():
+            snapshot[name] = read()
+        return snapshot
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), separators=(",", ":")).encode()
+
+    def report(self):
+        parts = [f"{self.frame_rate():.1f} fps"]
+        for name, hist in self.stages.items():
+            s = hist.summary()
+            parts.append(f"{name} p50 {s['p50']}us p99 {s['p99']}us max {s['max']}us")
+        return ", ".join(parts)
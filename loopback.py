@@ -0,0 +1,198 @@
+"""
+Local loopback of processed frames through shared memory, for tools on
+the Pi (visualisers, loggers, a USB gadget bridge) that should not have
+to pair over BLE.
+
+The writer keeps a ring of fixed-size slots in a memory-mapped file,
+normally under /dev/shm. Layout (little-endian):
+
+    header  "GLOVESHM", version u16, width u16, capacity u32,
+            slot size u32, pad u32, latest sequence u64
+    slot    sequence u64, monotonic time f64, buttons u32,
+            width x i16 axes, padded to 8 bytes
+
+Frame n lives in slot n % capacity. Each slot is its own seqlock: the
+writer zeroes the slot's sequence, writes the frame, stores the sequence
+and then bumps the header. A reader copies a slot and checks the
+sequence before and after; if the writer lapped it in between, the two
+differ and it retries. Readers never write, so any number can map the
+file and unpack straight from it without costing the glove anything.
+Timestamps are CLOCK_MONOTONIC, which is system-wide, so readers can
+work out a frame's age.
+
+    python loopback.py /dev/shm/glove
+"""
+import mmap
+import os
+import struct
+
+MAGIC = b"GLOVESHM"
+VERSION = 1
+
+# magic, version, width, capacity, slot size, pad, latest sequence
+HEADER = struct.Struct("<8sHHIIIQ")
+LATEST = struct.Struct("<Q")
+LATEST_OFFSET = HEADER.size - LATEST.size
+SEQ = struct.Struct("<Q")
+
+
+def slot_struct(width):
+    """
+    The frame after a slot's sequence: time, buttons and the axes.
+    """
+    return struct.Struct(f"<dI{width}h")
+
+
+def slot_size(width):
+    size = SEQ.size + slot_struct(width).size
+    return (size + 7) & ~7
+
+
+class LoopbackWriter:
+    """
+    Publishes frames to a shared-memory ring at path. write() is a few
+    pack_into calls on the mapping, the same cost whether nobody or many
+    readers are watching.
+
+    The file is built under a temporary name and renamed into place, so a
+    reader never maps a half-written header, and readers of a previous
+    run keep their old mapping instead of having it truncated under them.
+    """
+    def __init__(self, path, width, capacity=64):
+        if capacity < 2:
+            raise ValueError("capacity must be at least 2")
+        self.path = path
+        self.width = width
+        self.capacity = capacity
+        self.frame = slot_struct(width)
+        self.slot_size = slot_size(width)
+        self.seq = 0
+
+        size = HEADER.size + capacity * self.slot_size
+        temp = f"{path}.{os.getpid()}.tmp"
+        with open(temp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, width, capacity, self.slot_size, 0, 0))
+            f.truncate(size)
+        self._file = open(temp, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), size)
+        os.replace(temp, path)
+
+    def write(self, axes, button, timestamp):
+        mm = self._map
+        seq = self.seq + 1
+        offset = HEADER.size + (seq % self.capacity) * self.slot_size
+        SEQ.pack_into(mm, offset, 0)
+        self.frame.pack_into(mm, offset + SEQ.size, timestamp, button, *axes)
+        SEQ.pack_into(mm, offset, seq)
+        LATEST.pack_into(mm, LATEST_OFFSET, seq)
+        self.seq = seq
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            self._file.close()
+
+
+class LoopbackReader:
+    """
+    Maps a LoopbackWriter's file read-only.
+
+    latest() returns the newest frame; frames() yields every frame since
+    the previous call, oldest first. Frames are (seq, timestamp, button,
+    axes). A reader that falls more than the ring's capacity behind skips
+    ahead and counts the frames it lost in missed.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size:
+            self.close()
+            raise ValueError(f"{path} is too short to be a glove loopback")
+        magic, version, width, capacity, size, _, _ = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a glove loopback")
+        self.width = width
+        self.capacity = capacity
+        self.slot_size = size
+        self.frame = slot_struct(width)
+        self.last_seq = 0
+        self.missed = 0
+
+    def latest_seq(self):
+        return LATEST.unpack_from(self._map, LATEST_OFFSET)[0]
+
+    def read(self, seq):
+        """
+        Frame seq, or None if it has been overwritten (or not written yet).
+        """
+        mm = self._map
+        offset = HEADER.size + (seq % self.capacity) * self.slot_size
+        if SEQ.unpack_from(mm, offset)[0] != seq:
+            return None
+        timestamp, button, *axes = self.frame.unpack_from(mm, offset + SEQ.size)
+        if SEQ.unpack_from(mm, offset)[0] != seq:
+            return None
+        return seq, timestamp, button, axes
+
+    def latest(self):
+        while True:
+            seq = self.latest_seq()
+            if seq == 0:
+                return None
+            frame = self.read(seq)
+            if frame is not None:
+                self.last_seq = seq
+                return frame
+
+    def frames(self):
+        latest = self.latest_seq()
+        seq = self.last_seq + 1
+        if latest - seq >= self.capacity - 1:
+            # Lapped: the oldest slots are being rewritten, start past them
+            skip_to = latest - self.capacity + 2
+            self.missed += skip_to - seq
+            seq = skip_to
+        while seq <= latest:
+            frame = self.read(seq)
+            if frame is None:
+                self.missed += 1
+            else:
+                yield frame
+            self.last_seq = seq
+            seq += 1
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+def main():
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description="Print the frames a glove publishes locally")
+    parser.add_argument("path", help="loopback file, as LOOPBACK_PATH in main.py")
+    parser.add_argument("--interval", type=float, default=0.01, help="seconds between polls")
+    args = parser.parse_args()
+
+    reader = LoopbackReader(args.path)
+    print(f"{args.path}: {reader.width} axes, {reader.capacity} slots")
+    reader.last_seq = reader.latest_seq()
+    try:
+        while True:
+            for seq, timestamp, button, axes in reader.frames():
+                age = (time.monotonic() - timestamp) * 1000
+                print(f"{seq} {timestamp:.4f} age {age:.1f} ms buttons {button:04b} {axes}")
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("Missed", reader.missed, "frames")
+        reader.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,88 @@
+import asyncio
+import concurrent.futures
+import os
+import signal
+import time
+
 import dbus
 import dbus.mainloop.glib
-from gi.repository import GLib
-import threading
-import time
+from gi.events import GLibEventLoopPolicy
 
-from gatt_server import HIDService
-from sensors import read_flex_sensors
+from gatt_server import HIDService, DiagnosticsService
+from hid_descriptor import glove_layouts
+from sensors import MCP3008, FlexSampler, MultiSampler
+from calibration import Calibration
+from pipeline import FlexPipeline, build_filters
+from frame_ring import FrameRing
+from change_detect import ChangeDetector
+from profiles import ProfileStore, shaped_path
+from instrumentation import Instrumentation
+from health import ChannelHealth
+from rate_control import RateController
+from runtime import GloveRuntime, dbus_call
 from advertisement import Advertisement
 from agent import NoInputNoOutputAgent
 from agent import AGENT_PATH
 
 BLUEZ_SERVICE_NAME = "org.bluez"
 ADAPTER_IFACE = "org.bluez.Adapter1"
+DEVICE_IFACE = "org.bluez.Device1"
 GATT_MANAGER_IFACE = "org.bluez.GattManager1"
 LE_ADVERTISING_MANAGER_IFACE = "org.bluez.LEAdvertisingManager1"
 
+ADAPTER = "hci0"
+# One entry per glove, each served as its own HID service. id keys the
+# calibration profile; adcs lists MCP3008s as (SPI bus, chip select,
+# channels), concatenated into the glove's axes; imu is an MPU-6050
+# family IMU as (I2C bus, address), or None (needs smbus2)
+GLOVES = (
+    {"id": "default", "adcs": ((0, 0, (0, 1, 2, 3, 4)),), "imu": None},
+)
+SENSOR_RATE_HZ = 100
+IDLE_RATE_HZ = 10  # sampling rate while no client is subscribed, None disables
+OVERSAMPLE = 4  # ADC conversions per channel per frame, decimated into one value
+AUTO_RANGE = True  # widen calibration to each sensor's observed extremes
+SENSOR_HEALTH = True  # hold disconnected, saturated or stuck channels at their last good value
+STUCK_FRAMES = 1000  # frames without a single count of change before a channel counts as stuck
+# calibration profiles; the channel count and resolution are added to the
+# name, e.g. calibration-5ch-11b.bin
+PROFILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "calibration.bin")
+PROFILE_SAVE_FRAMES = 500  # write back refined calibration every N frames
+MIN_REPORT_INTERVAL_MS = 5  # shortest gap between reports
+MAX_REPORT_INTERVAL_MS = 100  # slowest the rate controller backs off to
+CONNECTION_INTERVAL_MS = 7.5  # assumed LE connection interval; a longer real one shows as backpressure
+NOTIFICATIONS_PER_EVENT = 1  # notifications the central accepts per connection event
+NUM_AXES = 5  # fingers; gestures look at the first NUM_AXES axes
+SEND_ON_CHANGE = True
+REPORT_DEADBAND = 400  # per-axis, in report units (~1 ADC count at the default scaling)
+REPORT_KEEPALIVE = 1.0  # seconds between reports while nothing changes
+# Each glove has a compact report, sent every report interval, and a full
+# one (see hid_descriptor.glove_layouts), sent at most this often
+DETAIL_REPORT_INTERVAL_MS = 20  # the full report also carries IMU orientation
+GESTURES = True  # derive buttons from finger poses (see gestures.DEFAULT_GESTURES)
+CURL_ON = 12000  # axis value above which a finger counts as curled
+CURL_OFF = 4000  # and below which it counts as straight again
+GESTURE_HOLD_FRAMES = 3  # frames a pose must hold before its buttons change
+IMU_RATE_HZ = 200  # IMU sample rate; its FIFO is drained once per frame
+IMU_AXES = 3  # roll, pitch, yaw, after the flex axes in each frame
+# file to record raw frames and sent reports to, None disables; with
+# several gloves each records to the path with -<id> before the extension.
+# Every session gets a new file with its start time added (see
+# recording.session_path), so a restart never overwrites the last one
+RECORD_PATH = None
+RECORD_FLUSH_FRAMES = 100  # hand the recording to the writer every N frames
+# shared-memory file every processed frame is published to for local
+# tools (see loopback.py), e.g. "/dev/shm/glove"; None disables. With
+# several gloves each gets -<id> appended, as with RECORD_PATH
+LOOPBACK_PATH = None
+REPORT_LOG_INTERVAL = None  # seconds between logged HID reports, None disables
+SHUTDOWN_TIMEOUT = 2.0  # seconds to wait for BlueZ unregistration on exit
+STATS_INTERVAL_FRAMES = 1000  # print scheduler stats every N frames, 0 disables
+# adc/filter/scale: pipeline stages, loop: whole sampling frame,
+# emit: send_report, age: sample timestamp to emit
+# imu: orientation fusion
+STAGES = ("adc", "filter", "scale", "imu", "loop", "emit", "age")
+
 
 class Application(dbus.service.Object):
     """
@@ -24,20 +92,19 @@ class Application(dbus.service.Object):
     def __init__(self, bus):
         self.path = "/aei/glove/hid"
         self.services = []
+        self.managed_objects = None
         dbus.service.Object.__init__(self, bus, self.path)
 
     def add_service(self, service):
         self.services.append(service)
+        self.managed_objects = None
 
-    def get_path(self):
-        return dbus.ObjectPath(self.path)
-
-    def get_services(self):
-        return self.services
-
-    @dbus.service.method("org.freedesktop.DBus.ObjectManager",
-                     out_signature="a{oa{sa{sv}}}")
-    def GetManagedObjects(self):
+    def build_managed_objects(self):
+        """
+        Build the GetManagedObjects reply. The GATT layout is fixed once
+        the services are added, so this runs once ahead of registration
+        instead of on every call from BlueZ.
+        """
         managed_objects = {}
         for service in self.services:
             managed_objects[service.get_path()] = service.get_properties()
@@ -46,86 +113,363 @@ class Application(dbus.service.Object):
                 if hasattr(chrc, "get_descriptors"):
                     for desc in chrc.get_descriptors():
                         managed_objects[desc.path] = desc.get_properties()
+        self.managed_objects = managed_objects
         return managed_objects
 
+    def get_path(self):
+        return dbus.ObjectPath(self.path)
 
+    def get_services(self):
+        return self.services
 
-def sensor_loop(hid_service):
+    @dbus.service.method("org.freedesktop.DBus.ObjectManager",
+                     out_signature="a{oa{sa{sv}}}")
+    def GetManagedObjects(self):
+        if self.managed_objects is None:
+            self.build_managed_objects()
+        return self.managed_objects
+
+
+def spi_groups(configs):
     """
-    Background loop that reads flex sensors and sends HID reports.
+    Indices of the gloves in configs grouped by shared SPI buses, directly
+    or through another glove. Each group's reads have to take turns.
     """
-    while True:
+    groups = []
+    for i, config in enumerate(configs):
+        buses = {spi_bus for spi_bus, _, _ in config["adcs"]}
+        members = [i]
+        for group in [g for g in groups if g[0] & buses]:
+            groups.remove(group)
+            buses |= group[0]
+            members += group[1]
+        groups.append((buses, sorted(members)))
+    return [members for _, members in groups]
+
+
+class Glove:
+    """
+    One configured glove: its ADCs and optional IMU, processing pipeline,
+    HID service and runtime.
+    """
+    def __init__(self, bus, index, config, profiles, executor=None, phase=None, record_path=None,
+                 loopback_path=None):
+        self.id = config["id"]
+        self.profiles = profiles
+        self.stats = Instrumentation(STAGES)
+
+        samplers = [FlexSampler(MCP3008(spi_bus, device), channels, OVERSAMPLE)
+                    for spi_bus, device, channels in config["adcs"]]
+        self.sampler = samplers[0] if len(samplers) == 1 else MultiSampler(samplers)
+        channels = len(self.sampler.channels)
+        print(f"Glove {self.id}: {channels} channels x{OVERSAMPLE} at {SENSOR_RATE_HZ} Hz, "
+              f"{self.sampler.sample_rate(SENSOR_RATE_HZ)} conversions/s, "
+              f"{self.sampler.resolution_bits}-bit")
+
+        self.hid_service = HIDService(bus, index, glove_layouts(channels))
+        input_report = self.hid_service.input_report
+        detail_reports = self.hid_service.input_reports[1:]
+        for report in detail_reports:
+            report.interval = DETAIL_REPORT_INTERVAL_MS / 1000.0
+        input_report.log_interval = REPORT_LOG_INTERVAL
+
+        self.calibration = Calibration(channels, adc_bits=self.sampler.resolution_bits)
+        if profiles.load(self.id, self.calibration):
+            print("Loaded calibration profile", self.id)
+        elif AUTO_RANGE:
+            # No profile: learn the range from this sensor's own travel
+            # rather than widening the defaults
+            self.calibration.reset_range(keep_current=False)
+        self.calibration.auto_range = AUTO_RANGE
+        self.pipeline = FlexPipeline(self.sampler, self.calibration,
+                                     build_filters(channels), self.stats)
+        self.health = None
+        if SENSOR_HEALTH:
+            self.health = ChannelHealth(channels, self.sampler.resolution_bits,
+                                        getattr(self.sampler, "groups", None),
+                                        stuck_frames=STUCK_FRAMES)
+            self.pipeline.health = self.health
+
+        self.imu = None
+        width = channels
+        if config.get("imu"):
+            # Optional features are imported only when configured, to keep startup short
+            from imu import Mpu6050
+            from pipeline import ImuPipeline
+            i2c_bus, address = config["imu"]
+            imu = Mpu6050(i2c_bus, address, IMU_RATE_HZ)
+            self.imu = ImuPipeline(imu, stats=self.stats)
+            width += IMU_AXES
+            print(f"Glove {self.id}: IMU at {imu.rate_hz:.0f} Hz")
+
+        if SEND_ON_CHANGE:
+            # The compact report carries the flex axes, the full one the
+            # whole frame, IMU axes included
+            input_report.change_detector = ChangeDetector(channels, REPORT_DEADBAND, REPORT_KEEPALIVE)
+            for report in detail_reports:
+                report.change_detector = ChangeDetector(width, REPORT_DEADBAND, REPORT_KEEPALIVE)
+
+        self.recorder = None
+        if record_path:
+            from recording import Recorder
+            self.recorder = Recorder(record_path, channels, self.sampler.resolution_bits)
+            self.pipeline.recorder = self.recorder
+            if self.imu is not None:
+                self.imu.recorder = self.recorder
+            input_report.recorder = self.recorder
+            print(f"Glove {self.id}: recording session to", self.recorder.path)
+
+        self.loopback = None
+        if loopback_path:
+            from loopback import LoopbackWriter
+            self.loopback = LoopbackWriter(loopback_path, width)
+            print(f"Glove {self.id}: publishing frames to", loopback_path)
+
+        gestures = None
+        if GESTURES and channels >= NUM_AXES:
+            from gestures import GestureEngine
+            gestures = GestureEngine(NUM_AXES, CURL_ON, CURL_OFF, hold_frames=GESTURE_HOLD_FRAMES)
+            gestures.on_event = lambda name, pressed: print(
+                f"Glove {self.id}: gesture", name, "pressed" if pressed else "released")
+        rate_controller = RateController(MIN_REPORT_INTERVAL_MS / 1000.0, MAX_REPORT_INTERVAL_MS / 1000.0,
+                                         CONNECTION_INTERVAL_MS / 1000.0, NOTIFICATIONS_PER_EVENT)
+        self.runtime = GloveRuntime(
+            self.pipeline, FrameRing(width=width), input_report,
+            rate_hz=SENSOR_RATE_HZ,
+            report_interval=MIN_REPORT_INTERVAL_MS / 1000.0,
+            stats=self.stats,
+            profiles=profiles,
+            profile_id=self.id,
+            profile_save_frames=PROFILE_SAVE_FRAMES,
+            stats_interval_frames=STATS_INTERVAL_FRAMES,
+            rate_controller=rate_controller,
+            idle_rate_hz=IDLE_RATE_HZ,
+            detail_reports=detail_reports,
+            gestures=gestures,
+            imu=self.imu,
+            executor=executor,
+            phase=phase,
+            loopback=self.loopback,
+            record_flush_frames=RECORD_FLUSH_FRAMES)
+        self.stats.sections["health"] = self.health_snapshot
+        self.stats.sections["reports"] = self.runtime.report_stats
+
+    def health_snapshot(self):
+        snapshot = self.health.snapshot() if self.health is not None else {}
+        snapshot["read_errors"] = self.runtime.errors
+        snapshot["reopens"] = self.runtime.reopens
+        if self.imu is not None:
+            snapshot["imu_errors"] = self.runtime.imu_errors
+            snapshot["imu_reopens"] = self.runtime.imu_reopens
+        return snapshot
+
+    def close(self):
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.loopback is not None:
+            self.loopback.close()
+        self.profiles.save(self.id, self.calibration)
+        self.sampler.close()
+        if self.imu is not None:
+            self.imu.imu.close()
+
+
+def open_profiles(configs):
+    """
+    One ProfileStore per distinct channel count, shared by the gloves that
+    have it, keyed by that count. Each file has its channel count and
+    resolution in the name (see profiles.shaped_path), so changing
+    OVERSAMPLE or GLOVES never opens a file of the wrong shape. A new file
+    imports the matching profiles from files of earlier shapes.
+    """
+    import glob
+    stores = {}
+    bits = FlexSampler.resolution_for(OVERSAMPLE)
+    root, ext = os.path.splitext(PROFILE_PATH)
+    for config in configs:
+        channels = sum(len(adc[2]) for adc in config["adcs"])
+        if channels in stores:
+            continue
+        path = shaped_path(PROFILE_PATH, channels, bits)
+        fresh = not os.path.exists(path)
         try:
-            axes = read_flex_sensors()
-            hid_service.input_report.send_report(axes)
-        except Exception as e:
-            print(f"Sensor error: {e}")
-            axes = [0, 0, 0, 0, 0]
-            hid_service.input_report.send_report(axes)
-        time.sleep(0.05)  # 20 Hz update rate
+            store = ProfileStore(path, channels, bits)
+        except ValueError as e:
+            print(f"{e}; moving it aside and starting a new profile file")
+            os.replace(path, path + ".bad")
+            store = ProfileStore(path, channels, bits)
+            fresh = True
+        if fresh:
+            # Earlier shapes, and the unshaped names used before them
+            sources = sorted(glob.glob(f"{glob.escape(root)}-{channels}ch-*b{ext}"))
+            sources += [f"{root}-{channels}ch{ext}", PROFILE_PATH]
+            for source in sources:
+                if source != path:
+                    imported = store.convert_from(source)
+                    if imported:
+                        print(f"Imported {imported} calibration profile(s) from", source)
+        stores[channels] = store
+    return stores
 
 
-def main():
-    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
-    bus = dbus.SystemBus()
-    adapter_path = "/org/bluez/hci0"
-    adapter_props = dbus.Interface(
-    bus.get_object(BLUEZ_SERVICE_NAME, adapter_path),
-    "org.freedesktop.DBus.Properties")
+def glove_path(path, config):
+    """
+    path for one glove's file: as given with one glove, with -<id> before
+    the extension with several.
+    """
+    if not path or len(GLOVES) == 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}-{config['id']}{ext}"
+
 
+async def setup_adapter(adapter_props):
     # Make discoverable
-    adapter_props.Set(ADAPTER_IFACE, "Discoverable", dbus.Boolean(True))
-    adapter_props.Set(ADAPTER_IFACE, "Alias", "GloveJoystick")
-    adapter_props.Set(ADAPTER_IFACE, "DiscoverableTimeout", dbus.UInt32(0))
+    await asyncio.gather(
+        dbus_call(adapter_props.Set, ADAPTER_IFACE, "Discoverable", dbus.Boolean(True)),
+        dbus_call(adapter_props.Set, ADAPTER_IFACE, "Alias", "GloveJoystick"),
+        dbus_call(adapter_props.Set, ADAPTER_IFACE, "DiscoverableTimeout", dbus.UInt32(0)))
+
+
+async def register(name, call):
+    """
+    Await one BlueZ registration call, reporting rather than raising a
+    failure so the others carry on.
+    """
+    try:
+        await call
+        print(name, "registered")
+        return True
+    except dbus.exceptions.DBusException as e:
+        print(f"Failed to register {name}:", e)
+        return False
+
+
+async def register_agent(agent_manager):
+    await dbus_call(agent_manager.RegisterAgent, AGENT_PATH, "NoInputNoOutput")
+    await dbus_call(agent_manager.RequestDefaultAgent, AGENT_PATH)
+
+
+async def run():
+    started = time.monotonic()
+    bus = dbus.SystemBus()
+    adapter_path = "/org/bluez/" + ADAPTER
 
     # Create GATT application
     app = Application(bus)
 
-    # Add HID service
-    hid_service = HIDService(bus, 0)
-    app.add_service(hid_service)
+    # One HID service and sampling pipeline per glove. Gloves sharing an
+    # SPI bus share one reader thread and sample at staggered phases.
+    profiles = open_profiles(GLOVES)
+    executors = []
+    gloves = [None] * len(GLOVES)
+    for members in spi_groups(GLOVES):
+        executor = None
+        if len(members) > 1:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="spi")
+            executors.append(executor)
+        for k, i in enumerate(members):
+            config = GLOVES[i]
+            channels = sum(len(adc[2]) for adc in config["adcs"])
+            phase = k / len(members) if len(members) > 1 else None
+            gloves[i] = Glove(bus, i, config, profiles[channels], executor, phase,
+                              glove_path(RECORD_PATH, config), glove_path(LOOPBACK_PATH, config))
+    for glove in gloves:
+        app.add_service(glove.hid_service)
 
-    # Register GATT app
-    gatt_manager = dbus.Interface(
-        bus.get_object(BLUEZ_SERVICE_NAME, adapter_path),
-        GATT_MANAGER_IFACE
-    )
-    gatt_manager.RegisterApplication(
-        app.get_path(), 
-        {"RequireAuthentication": dbus.Boolean(False),
-         "RequireAuthorization": dbus.Boolean(False)},
-        reply_handler=lambda: print("GATT application registered"),
-        error_handler=lambda e: print("Failed to register application:", e)
-    )
+    if len(gloves) == 1:
+        read_stats = gloves[0].stats.to_json
+    else:
+        import json
 
-    # Register Advertisement
-    ad_manager = dbus.Interface(
-        bus.get_object(BLUEZ_SERVICE_NAME, adapter_path),
-        LE_ADVERTISING_MANAGER_IFACE
-    )
-    advertisement = Advertisement(bus, 0, "peripheral")
-    ad_manager.RegisterAdvertisement(
-        advertisement.get_path(), {},
-        reply_handler=lambda: print("Advertisement registered"),
-        error_handler=lambda e: print("Failed to register advertisement:", e)
-    )
+        def read_stats():
+            return json.dumps({g.id: g.stats.snapshot() for g in gloves},
+                              separators=(",", ":")).encode()
+    app.add_service(DiagnosticsService(bus, len(gloves), read_stats))
+    runtimes = [glove.runtime for glove in gloves]
 
-    # Register NoInputNoOutput agent
-    agent = NoInputNoOutputAgent(bus)
+    def stop():
+        for runtime in runtimes:
+            runtime.stop()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop)
+
+    # Sample from the start, so filters and auto-range are settled and a
+    # current frame is waiting by the time a central subscribes
+    tasks = [asyncio.create_task(runtime.run()) for runtime in runtimes]
+    print(f"Sampling {len(gloves)} glove(s) after {(time.monotonic() - started) * 1000:.0f} ms")
+
+    def device_properties_changed(interface, changed, invalidated, path=None):
+        if interface == DEVICE_IFACE and "Connected" in changed:
+            for runtime in runtimes:
+                runtime.device_changed(path, bool(changed["Connected"]))
+
+    bus.add_signal_receiver(device_properties_changed,
+                            dbus_interface="org.freedesktop.DBus.Properties",
+                            signal_name="PropertiesChanged",
+                            arg0=DEVICE_IFACE,
+                            path_keyword="path")
+
+    adapter = bus.get_object(BLUEZ_SERVICE_NAME, adapter_path)
+    adapter_props = dbus.Interface(adapter, "org.freedesktop.DBus.Properties")
+    gatt_manager = dbus.Interface(adapter, GATT_MANAGER_IFACE)
+    ad_manager = dbus.Interface(adapter, LE_ADVERTISING_MANAGER_IFACE)
     agent_manager = dbus.Interface(
         bus.get_object(BLUEZ_SERVICE_NAME, "/org/bluez"),
         "org.bluez.AgentManager1"
     )
-    agent_manager.RegisterAgent(AGENT_PATH, "NoInputNoOutput")
-    agent_manager.RequestDefaultAgent(AGENT_PATH)
-    print("NoInputNoOutput agent registered")
+    advertisement = Advertisement(bus, 0, "peripheral")
+    agent = NoInputNoOutputAgent(bus)
+    app.build_managed_objects()
 
-    # Start sensor thread
-    threading.Thread(target=sensor_loop, args=(hid_service,), daemon=True).start()
+    try:
+        # The registrations don't depend on each other, so they go out together
+        await asyncio.gather(
+            setup_adapter(adapter_props),
+            register("GATT application",
+                     dbus_call(gatt_manager.RegisterApplication, app.get_path(),
+                               {"RequireAuthentication": dbus.Boolean(False),
+                                "RequireAuthorization": dbus.Boolean(False)})),
+            register("Advertisement",
+                     dbus_call(ad_manager.RegisterAdvertisement, advertisement.get_path(), {})),
+            register("NoInputNoOutput agent", register_agent(agent_manager)))
+        print(f"BlueZ ready after {(time.monotonic() - started) * 1000:.0f} ms")
 
-    print("Running HID joystick service...")
-    loop = GLib.MainLoop()
-    loop.run()
+        print(f"Running HID joystick service for {len(gloves)} glove(s)...")
+        # One glove stopping (a failed task) stops them all
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        print("Shutting down...")
+        stop()
+        try:
+            await asyncio.gather(*tasks, return_exceptions=True)
+            try:
+                await asyncio.wait_for(asyncio.gather(
+                    dbus_call(ad_manager.UnregisterAdvertisement, advertisement.get_path()),
+                    dbus_call(gatt_manager.UnregisterApplication, app.get_path()),
+                    dbus_call(agent_manager.UnregisterAgent, AGENT_PATH),
+                    return_exceptions=True), SHUTDOWN_TIMEOUT)
+            except asyncio.TimeoutError:
+                print(f"BlueZ did not answer within {SHUTDOWN_TIMEOUT} s, exiting anyway")
+        finally:
+            # Recordings, calibration and the loopback file are closed
+            # whatever happened above
+            for executor in executors:
+                executor.shutdown(wait=True)
+            for glove in gloves:
+                glove.close()
+            for store in profiles.values():
+                store.close()
+
+
+def main():
+    # asyncio on top of the GLib main context, so dbus-python callbacks
+    # and the runtime's tasks share one thread
+    asyncio.set_event_loop_policy(GLibEventLoopPolicy())
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    asyncio.run(run())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,149 @@
+import math
+import time
+
+from calibration import OUT_MAX
+from filters import FilterPipeline, MedianFilter, OneEuroFilter
+
+MEDIAN_WINDOW = 3  # despike window in samples, 1 disables
+ONE_EURO_MIN_CUTOFF = 1.0  # Hz, smoothing while the finger is still
+ONE_EURO_BETA = 0.01  # cutoff increase per raw count/s of finger speed
+
+
+def build_filters(channels, median_window=MEDIAN_WINDOW,
+                  min_cutoff=ONE_EURO_MIN_CUTOFF, beta=ONE_EURO_BETA):
+    """
+    The default filter chain: median despike followed by One Euro.
+    """
+    filters = FilterPipeline()
+    if median_window > 1:
+        filters.add(MedianFilter(channels, median_window))
+    filters.add(OneEuroFilter(channels, min_cutoff, beta))
+    return filters
+
+
+class FlexPipeline:
+    """
+    Per-frame processing for one glove: read all channels, run the
+    filter stage on the raw counts, then scale through the calibration
+    tables. Every buffer is allocated once; process() returns the same
+    axes list each call. If an Instrumentation is given, the adc, filter
+    and scale stages are timed.
+    """
+    def __init__(self, sampler, calibration, filters=None, stats=None):
+        if len(sampler.channels) != calibration.channels:
+            raise ValueError("Sampler and calibration channel counts differ")
+        self.sampler = sampler
+        self.calibration = calibration
+        self.filters = filters if filters is not None else FilterPipeline()
+        self.stats = stats
+        # Optional recording.Recorder; gets every raw frame
+        self.recorder = None
+        # Optional health.ChannelHealth; repairs frames after they are
+        # recorded, and raises BusFault (an OSError) for a dead ADC
+        self.health = None
+        n = calibration.channels
+        self.values = [0.0] * n
+        self.indices = [0] * n
+        self.axes = [0] * n
+
+    def process(self, timestamp):
+        stats = self.stats
+        if stats is not None:
+            t = time.perf_counter_ns()
+        raw = self.sampler.read()
+        if stats is not None:
+            stats.record("adc", t)
+        return self.transform(raw, timestamp)
+
+    def transform(self, raw, timestamp):
+        """
+        Filter and scale one frame of raw values already read from the
+        sampler. Split from process() so the blocking SPI read can run
+        elsewhere.
+        """
+        stats = self.stats
+        if stats is not None:
+            t = time.perf_counter_ns()
+        if self.recorder is not None:
+            self.recorder.write_raw(timestamp, raw)
+        if self.health is not None:
+            raw = self.health.check(raw)
+        values = self.values
+        values[:] = raw
+        self.filters.apply(values, timestamp)
+        if stats is not None:
+            t = stats.record("filter", t)
+
+        calibration = self.calibration
+        top = calibration.size - 1
+        indices = self.indices
+        for i in range(len(indices)):
+            v = int(values[i] + 0.5)
+            indices[i] = 0 if v < 0 else top if v > top else v
+        if calibration.auto_range:
+            calibration.observe(indices)
+        calibration.scale(indices, self.axes)
+        if stats is not None:
+            stats.record("scale", t)
+        return self.axes
+
+
+class ImuPipeline:
+    """
+    Per-frame orientation from the IMU: drain its FIFO, fuse the batch
+    and express roll, pitch and yaw as three axes in report units
+    (OUT_MAX is half a turn). read() is the blocking I2C part and can
+    run elsewhere, like FlexSampler.read(); transform() does the math.
+    Frames with no new IMU samples keep the previous axes.
+    """
+    def __init__(self, imu, fusion=None, stats=None):
+        # Imported here so gloves without an IMU never load them
+        from fusion import OrientationFilter
+        from imu import SAMPLE
+        self.imu = imu
+        self.fusion = fusion if fusion is not None else OrientationFilter()
+        self._sample = SAMPLE
+        self.stats = stats
+        # Optional recording.Recorder; gets every FIFO batch
+        self.recorder = None
+        self.batch = b""
+        self.samples = 0
+        self.axes = [0, 0, 0]
+        self._scale = OUT_MAX / math.pi
+
+    def read(self):
+        self.batch = self.imu.read_fifo()
+        return self.batch
+
+    def transform(self, batch, timestamp):
+        if not batch:
+            return self.axes
+        stats = self.stats
+        if stats is not None:
+            t = time.perf_counter_ns()
+        if self.recorder is not None:
+            self.recorder.write_imu(timestamp, batch)
+        sax = say = saz = sgx = sgy = sgz = 0
+        for ax, ay, az, gx, gy, gz in self._sample.iter_unpack(batch):
+            sax += ax
+            say += ay
+            saz += az
+            sgx += gx
+            sgy += gy
+            sgz += gz
+        n = len(batch) // self._sample.size
+        self.samples += n
+        imu = self.imu
+        accel = n * imu.accel_lsb
+        gyro = n * imu.gyro_lsb
+        self.fusion.update((sax / accel, say / accel, saz / accel),
+                           (sgx / gyro, sgy / gyro, sgz / gyro), n / imu.rate_hz)
+        roll, pitch, yaw = self.fusion.euler()
+        scale = self._scale
+        axes = self.axes
+        axes[0] = int(roll * scale)
+        axes[1] = int(pitch * scale)
+        axes[2] = int(yaw * scale)
+        if stats is not None:
+            stats.record("imu", t)
+        return axes
@@ -0,0 +1,200 @@
+import mmap
+import os
+import struct
+from array import array
+
+from calibration import ADC_BITS, Calibration
+
+MAGIC = b"GLOVECAL"
+VERSION = 1
+KEY_SIZE = 16
+
+# magic, version, channels, adc_bits, record count
+HEADER = struct.Struct("<8sHHHH")
+
+
+def shaped_path(path, channels, adc_bits):
+    """
+    path with the profile shape before the extension, so stores of
+    different shapes never share a file.
+    """
+    root, ext = os.path.splitext(path)
+    return f"{root}-{channels}ch-{adc_bits}b{ext}"
+
+
+def read_profiles(path):
+    """
+    Every profile in a store file of any shape, as (key, channels,
+    raw_min, raw_max, offset, curve). The parameters don't depend on the
+    ADC resolution, so they can be rebuilt into tables of another one.
+    Returns an empty list if path is missing or not a profile file.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return []
+    if len(data) < HEADER.size:
+        return []
+    magic, version, channels, adc_bits, count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        return []
+    n = channels
+    params = struct.Struct(f"<{n}f{n}f{n}l{n}f")
+    record_size = KEY_SIZE + params.size + channels * (2 << adc_bits)
+    profiles = []
+    for i in range(count):
+        offset = HEADER.size + i * record_size
+        if offset + record_size > len(data):
+            break
+        key = data[offset:offset + KEY_SIZE].rstrip(b"\0").decode()
+        values = params.unpack_from(data, offset + KEY_SIZE)
+        profiles.append((key, channels, values[0:n], values[n:2 * n],
+                         values[2 * n:3 * n], values[3 * n:4 * n]))
+    return profiles
+
+
+class ProfileStore:
+    """
+    Calibration profiles keyed by user or glove ID, kept in one
+    memory-mapped file of fixed-size records.
+
+    A record holds the key, the per-channel parameters and the compiled
+    lookup tables, so load() is a straight copy into a Calibration with no
+    rebuilding. save() writes the parameters and only the tables rebuilt
+    since the last save in place; the kernel writes the dirty pages back,
+    so saving from the sampling loop costs a memcpy, not a disk wait.
+    Tables are stored in native byte order (little-endian on the Pi).
+    """
+    def __init__(self, path, channels=5, adc_bits=ADC_BITS):
+        self.path = path
+        self.channels = channels
+        self.adc_bits = adc_bits
+        n = channels
+        self.params = struct.Struct(f"<{n}f{n}f{n}l{n}f")
+        self.lut_bytes = 2 << adc_bits
+        self.record_size = KEY_SIZE + self.params.size + channels * self.lut_bytes
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a+b")
+        self._file.seek(0, os.SEEK_END)
+        if self._file.tell() == 0:
+            self._file.write(HEADER.pack(MAGIC, VERSION, channels, adc_bits, 0))
+            self._file.flush()
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+        magic, version, file_channels, file_bits, count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a calibration profile file")
+        if file_channels != channels or file_bits != adc_bits:
+            self.close()
+            raise ValueError(f"{path} holds {file_channels}-channel {file_bits}-bit profiles, "
+                             f"expected {channels}-channel {adc_bits}-bit")
+        self.index = {}
+        for i in range(count):
+            offset = HEADER.size + i * self.record_size
+            key = self._map[offset:offset + KEY_SIZE].rstrip(b"\0").decode()
+            self.index[key] = offset
+
+    def keys(self):
+        return list(self.index)
+
+    def _encode_key(self, key):
+        encoded = key.encode()
+        if len(encoded) > KEY_SIZE:
+            raise ValueError(f"Profile ID must be at most {KEY_SIZE} bytes")
+        return encoded.ljust(KEY_SIZE, b"\0")
+
+    def _check(self, calibration):
+        if calibration.channels != self.channels or calibration.adc_bits != self.adc_bits:
+            raise ValueError("Calibration layout does not match the profile store")
+
+    def load(self, key, calibration):
+        """
+        Copy the stored profile into calibration.
+        Returns False if there is no profile for key.
+        """
+        self._check(calibration)
+        offset = self.index.get(key)
+        if offset is None:
+            return False
+        n = self.channels
+        values = self.params.unpack_from(self._map, offset + KEY_SIZE)
+        calibration.raw_min[:] = array("f", values[0:n])
+        calibration.raw_max[:] = array("f", values[n:2 * n])
+        calibration.offset[:] = array("l", values[2 * n:3 * n])
+        calibration.curve[:] = array("f", values[3 * n:4 * n])
+
+        lut_offset = offset + KEY_SIZE + self.params.size
+        with memoryview(self._map) as view:
+            for ch, lut in enumerate(calibration.luts):
+                start = lut_offset + ch * self.lut_bytes
+                memoryview(lut).cast("B")[:] = view[start:start + self.lut_bytes]
+        calibration.unsaved.clear()
+        calibration.reset_range()
+        return True
+
+    def save(self, key, calibration):
+        """
+        Write calibration under key. Existing records are updated in place
+        with only the tables that changed; new keys are appended.
+        """
+        self._check(calibration)
+        offset = self.index.get(key)
+        if offset is None:
+            offset = self._append(key)
+            channels = range(self.channels)
+        else:
+            channels = tuple(calibration.unsaved)
+
+        self.params.pack_into(self._map, offset + KEY_SIZE,
+                              *calibration.raw_min, *calibration.raw_max,
+                              *calibration.offset, *calibration.curve)
+        lut_offset = offset + KEY_SIZE + self.params.size
+        for ch in channels:
+            start = lut_offset + ch * self.lut_bytes
+            self._map[start:start + self.lut_bytes] = memoryview(calibration.luts[ch]).cast("B")
+        calibration.unsaved.clear()
+
+    def _append(self, key):
+        encoded = self._encode_key(key)
+        count = len(self.index)
+        offset = HEADER.size + count * self.record_size
+        self._map.resize(offset + self.record_size)
+        self._map[offset:offset + KEY_SIZE] = encoded
+        HEADER.pack_into(self._map, 0, MAGIC, VERSION, self.channels, self.adc_bits, count + 1)
+        self.index[key] = offset
+        return offset
+
+    def convert_from(self, path):
+        """
+        Import the profiles of another store file with the same channel
+        count but possibly another resolution, rebuilding their tables
+        for this one. Keys already here are kept. Returns the number
+        imported.
+        """
+        imported = 0
+        for key, channels, raw_min, raw_max, offset, curve in read_profiles(path):
+            if channels != self.channels or key in self.index:
+                continue
+            calibration = Calibration(channels, adc_bits=self.adc_bits)
+            calibration.raw_min[:] = array("f", raw_min)
+            calibration.raw_max[:] = array("f", raw_max)
+            calibration.offset[:] = array("l", offset)
+            calibration.curve[:] = array("f", curve)
+            calibration.rebuild()
+            self.save(key, calibration)
+            imported += 1
+        return imported
+
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        if not self._map.closed:
+            self._map.flush()
+            self._map.close()
+        self._file.close()
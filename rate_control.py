@@ -0,0 +1,57 @@
+class RateController:
+    """
+    Picks the report interval from the link's capacity and how well
+    notifications are getting through.
+
+    The interval never goes below one connection interval divided by the
+    notifications the link fits per connection event; sending faster only
+    queues reports in BlueZ. BlueZ does not expose the negotiated
+    interval, so connection_interval is a configured assumption and a
+    longer real interval shows up as backpressure instead. Within that
+    floor, it backs off multiplicatively whenever a report is congested
+    (the notify socket was full or the emit was slow) and creeps back
+    down additively while reports flow.
+    """
+    def __init__(self, min_interval=0.005, max_interval=0.1, connection_interval=0.0075,
+                 notifications_per_event=1, backoff=1.5, recover=0.0005, slow_emit=0.005):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.notifications_per_event = notifications_per_event
+        self.backoff = backoff
+        self.recover = recover
+        self.slow_emit = slow_emit
+        self.backoffs = 0
+        self.set_connection_interval(connection_interval)
+        self.interval = self.floor
+
+    def set_connection_interval(self, seconds):
+        self.connection_interval = seconds
+        link_floor = seconds / self.notifications_per_event
+        self.floor = min(max(self.min_interval, link_floor), self.max_interval)
+        if getattr(self, "interval", 0.0) < self.floor:
+            self.interval = self.floor
+
+    def reset(self):
+        """
+        Start again from the fastest rate the link allows, e.g. after a
+        new central connects.
+        """
+        self.interval = self.floor
+
+    def on_report(self, congested, emit_seconds=0.0):
+        if congested or emit_seconds > self.slow_emit:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+            self.backoffs += 1
+        elif self.interval > self.floor:
+            self.interval = max(self.interval - self.recover, self.floor)
+
+    @property
+    def rate_hz(self):
+        return 1.0 / self.interval
+
+    def stats(self):
+        return {
+            "report_hz": round(self.rate_hz, 1),
+            "connection_interval_ms": self.connection_interval * 1000.0,
+            "backoffs": self.backoffs,
+        }
@@ -0,0 +1,379 @@
+"""
+Compact append-only recordings of glove sessions, and a replay driver.
+
+File layout (little-endian): a header, then records back to back.
+
+    header  "GLOVEREC", version u16, channels u16, resolution_bits u16,
+            pad u16, wall-clock start f64
+    raw     type u8 = 1, monotonic time f64, channels x u16 raw ADC values
+    report  type u8 = 2, monotonic time f64, length u8, payload bytes
+    imu     type u8 = 3, monotonic time f64, length u16, raw IMU FIFO bytes
+
+Each session gets its own file, with its start time before the
+extension, so a restart after a crash never overwrites the session that
+crashed.
+
+    python recording.py info session-20240101-120000.rec
+    python recording.py replay session-20240101-120000.rec --speed 4
+"""
+import os
+import queue
+import struct
+import threading
+import time
+
+MAGIC = b"GLOVEREC"
+VERSION = 2
+READ_VERSIONS = (1, 2)  # version 1 files have no IMU records
+HEADER = struct.Struct("<8sHHHHd")
+RECORD_RAW = 1
+RECORD_REPORT = 2
+RECORD_IMU = 3
+REPORT_HEAD = struct.Struct("<BdB")
+IMU_HEAD = struct.Struct("<BdH")
+BLOCK_SIZE = 64 * 1024
+BLOCKS = 4
+
+
+def session_path(path, started):
+    """
+    path with the session's start time before the extension, and a
+    counter after it if that file exists already.
+    """
+    root, ext = os.path.splitext(path)
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(started))
+    candidate = f"{root}-{stamp}{ext}"
+    n = 1
+    while os.path.exists(candidate):
+        candidate = f"{root}-{stamp}-{n}{ext}"
+        n += 1
+    return candidate
+
+
+class Recorder:
+    """
+    Appends raw frames, IMU batches and sent reports to a recording.
+
+    Records are packed into preallocated blocks; full blocks go to a
+    writer thread, so the sampling loop never waits on the SD card. If
+    the writer falls so far behind that every block is in flight,
+    records are dropped and counted instead of blocking. Call flush()
+    regularly so a power cut loses seconds, not a whole block; the
+    writer syncs the file after every block it writes.
+
+    The file is a new one named from path by session_path(); self.path
+    is the name it got.
+    """
+    def __init__(self, path, channels=5, resolution_bits=10):
+        started = time.time()
+        self.path = session_path(path, started)
+        self.channels = channels
+        self.raw_record = struct.Struct(f"<Bd{channels}H")
+        self._file = open(self.path, "xb")
+        self._file.write(HEADER.pack(MAGIC, VERSION, channels, resolution_bits, 0, started))
+        self._free = queue.Queue()
+        for _ in range(BLOCKS):
+            self._free.put(bytearray(BLOCK_SIZE))
+        self._full = queue.Queue()
+        self._block = self._free.get()
+        self._used = 0
+        self._lock = threading.Lock()
+        self.records = 0
+        self.dropped = 0
+        self.closed = False
+        self._writer = threading.Thread(target=self._write_blocks, daemon=True)
+        self._writer.start()
+
+    def _reserve(self, size):
+        """
+        Make room for size bytes in the current block. Returns False if
+        no block is available.
+        """
+        if self._block is None or self._used + size > BLOCK_SIZE:
+            if self._block is not None:
+                self._full.put((self._block, self._used))
+                self._block = None
+            try:
+                self._block = self._free.get_nowait()
+            except queue.Empty:
+                return False
+            self._used = 0
+        return True
+
+    def write_raw(self, timestamp, raw):
+        with self._lock:
+            if self.closed or not self._reserve(self.raw_record.size):
+                self.dropped += 1
+                return
+            self.raw_record.pack_into(self._block, self._used, RECORD_RAW, timestamp, *raw)
+            self._used += self.raw_record.size
+            self.records += 1
+
+    def write_report(self, timestamp, payload):
+        self._write_bytes(REPORT_HEAD, RECORD_REPORT, timestamp, payload)
+
+    def write_imu(self, timestamp, batch):
+        self._write_bytes(IMU_HEAD, RECORD_IMU, timestamp, batch)
+
+    def _write_bytes(self, head, kind, timestamp, payload):
+        size = head.size + len(payload)
+        with self._lock:
+            if self.closed or not self._reserve(size):
+                self.dropped += 1
+                return
+            head.pack_into(self._block, self._used, kind, timestamp, len(payload))
+            start = self._used + head.size
+            self._block[start:start + len(payload)] = payload
+            self._used += size
+            self.records += 1
+
+    def _write_blocks(self):
+        while True:
+            item = self._full.get()
+            if item is None:
+                break
+            block, used = item
+            self._file.write(memoryview(block)[:used])
+            self._free.put(block)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def flush(self):
+        """
+        Hand the partly filled block to the writer.
+        """
+        with self._lock:
+            if self._block is not None and self._used:
+                self._full.put((self._block, self._used))
+                self._block = None
+                self._used = 0
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        with self._lock:
+            self.closed = True
+        self._full.put(None)
+        self._writer.join()
+        self._file.close()
+
+
+class Recording:
+    """
+    A recording loaded into memory: raw frames, IMU batches and sent
+    reports, each a list of (timestamp, values) in file order.
+    """
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < HEADER.size:
+            raise ValueError(f"{path} is too short to be a recording")
+        magic, version, channels, bits, _, started = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version not in READ_VERSIONS:
+            raise ValueError(f"{path} is not a glove recording")
+        self.channels = channels
+        self.resolution_bits = bits
+        self.started = started
+        self.frames = []
+        self.reports = []
+        self.imu = []
+
+        raw_record = struct.Struct(f"<Bd{channels}H")
+        offset = HEADER.size
+        while offset < len(data):
+            kind = data[offset]
+            if kind == RECORD_RAW and offset + raw_record.size <= len(data):
+                values = raw_record.unpack_from(data, offset)
+                self.frames.append((values[1], values[2:]))
+                offset += raw_record.size
+            elif kind in (RECORD_REPORT, RECORD_IMU):
+                head, records = ((REPORT_HEAD, self.reports) if kind == RECORD_REPORT
+                                 else (IMU_HEAD, self.imu))
+                if offset + head.size > len(data):
+                    break
+                _, timestamp, length = head.unpack_from(data, offset)
+                start = offset + head.size
+                if start + length > len(data):
+                    break
+                records.append((timestamp, data[start:start + length]))
+                offset = start + length
+            else:
+                # Truncated tail from a power cut; keep what was complete
+                break
+
+    def duration(self):
+        if len(self.frames) < 2:
+            return 0.0
+        return self.frames[-1][0] - self.frames[0][0]
+
+
+class ReplaySampler:
+    """
+    Drop-in for FlexSampler that returns recorded raw frames in order,
+    so a recording can be run through FlexPipeline.
+    """
+    def __init__(self, recording):
+        self.recording = recording
+        self.channels = tuple(range(recording.channels))
+        self.resolution_bits = recording.resolution_bits
+        self.raw = [0] * recording.channels
+        self.index = 0
+
+    def read(self):
+        _, values = self.recording.frames[self.index]
+        self.raw[:] = values
+        self.index += 1
+        return self.raw
+
+    def close(self):
+        pass
+
+
+class ReplayImu:
+    """
+    Stands in for imu.Mpu6050 under an ImuPipeline fed recorded batches:
+    just the scale and rate the batches were sampled with, which the
+    recording does not store. The defaults are Mpu6050's.
+    """
+    def __init__(self, rate_hz=200, accel_range=4, gyro_range=500):
+        from imu import ACCEL_RANGES, GYRO_RANGES, INTERNAL_RATE_HZ
+        divider = max(0, min(255, round(INTERNAL_RATE_HZ / rate_hz) - 1))
+        self.rate_hz = INTERNAL_RATE_HZ / (divider + 1)
+        self.accel_lsb = ACCEL_RANGES[accel_range][1]
+        self.gyro_lsb = GYRO_RANGES[gyro_range][1]
+
+
+def replay(recording, pipeline, on_frame, speed=1.0, imu=None):
+    """
+    Feed every recorded frame through pipeline (built on a ReplaySampler
+    for recording) and call on_frame(timestamp, axes). With an
+    ImuPipeline (on a ReplayImu) the IMU batches read with each frame are
+    fused too and its axes follow the flex axes, as on the glove. speed
+    is a time multiplier; 0 replays as fast as possible. Returns the
+    frame count.
+    """
+    frames = recording.frames
+    if not frames:
+        return 0
+    batches = recording.imu if imu is not None else ()
+    next_batch = 0
+    frame = []
+    first = frames[0][0]
+    started = time.monotonic()
+    for timestamp, _ in frames:
+        if speed > 0:
+            delay = (timestamp - first) / speed - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+        axes = pipeline.process(timestamp)
+        if imu is not None:
+            # A frame's batch is recorded with the frame's timestamp
+            batch = b""
+            while next_batch < len(batches) and batches[next_batch][0] <= timestamp:
+                batch += batches[next_batch][1]
+                next_batch += 1
+            frame[:] = axes
+            frame += imu.transform(batch, timestamp)
+            axes = frame
+        on_frame(timestamp, axes)
+    return len(frames)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Inspect or replay a glove recording")
+    parser.add_argument("command", choices=("info", "replay"))
+    parser.add_argument("path")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="replay speed multiplier, 0 for as fast as possible")
+    parser.add_argument("--print", action="store_true", help="print every replayed frame")
+    parser.add_argument("--deadband", type=int, default=400,
+                        help="report deadband in report units, as REPORT_DEADBAND in main.py")
+    parser.add_argument("--keepalive", type=float, default=1.0)
+    parser.add_argument("--no-auto-range", action="store_true")
+    parser.add_argument("--profiles", help="calibration profile file to start from, "
+                                           "as the glove did (see profiles.shaped_path)")
+    parser.add_argument("--id", default="default", help="glove ID of the profile to load")
+    parser.add_argument("--no-gestures", action="store_true")
+    parser.add_argument("--imu-rate", type=float, default=200.0,
+                        help="IMU sample rate, as IMU_RATE_HZ in main.py")
+    args = parser.parse_args()
+
+    recording = Recording(args.path)
+    print(f"{args.path}: {recording.channels} channels, {recording.resolution_bits}-bit, "
+          f"{len(recording.frames)} frames, {len(recording.imu)} IMU batches, "
+          f"{len(recording.reports)} reports, "
+          f"{recording.duration():.1f} s, started {time.ctime(recording.started)}")
+    if args.command == "info":
+        return
+
+    # Run through the same filter, calibration, IMU fusion, gesture,
+    # change-detection and report packing stages as the glove
+    from calibration import Calibration
+    from change_detect import ChangeDetector
+    from hid_descriptor import glove_layouts
+    from pipeline import FlexPipeline, build_filters
+
+    channels = recording.channels
+    sampler = ReplaySampler(recording)
+    calibration = Calibration(channels, adc_bits=recording.resolution_bits)
+    loaded = False
+    if args.profiles:
+        from profiles import ProfileStore
+        store = ProfileStore(args.profiles, channels, recording.resolution_bits)
+        loaded = store.load(args.id, calibration)
+        if not loaded:
+            print("No profile for", args.id, "in", args.profiles)
+        store.close()
+    calibration.auto_range = not args.no_auto_range
+    if calibration.auto_range and not loaded:
+        calibration.reset_range(keep_current=False)
+    pipeline = FlexPipeline(sampler, calibration, build_filters(channels))
+    imu = None
+    if recording.imu:
+        from pipeline import ImuPipeline
+        imu = ImuPipeline(ReplayImu(args.imu_rate))
+    gestures = None
+    if not args.no_gestures and channels >= 5:
+        from gestures import GestureEngine
+        gestures = GestureEngine(5)
+    # The recorded reports are the compact ones (the glove's primary input report)
+    layout = glove_layouts(channels)[0]
+    report = bytearray(layout.size)
+    now = [0.0]
+    detector = ChangeDetector(channels, args.deadband, args.keepalive, clock=lambda: now[0])
+    # Each recorded report is compared with the newest frame replayed by
+    # its send time, which is the frame the glove sent
+    recorded = recording.reports
+    compared = [0, 0, 0]  # next recorded report, matched, checked
+    latest = [None]
+
+    def check_reports(until):
+        while compared[0] < len(recorded) and (until is None or recorded[compared[0]][0] < until):
+            if latest[0] is not None:
+                compared[2] += 1
+                if recorded[compared[0]][1] == latest[0]:
+                    compared[1] += 1
+            compared[0] += 1
+
+    def on_frame(timestamp, axes):
+        check_reports(timestamp)
+        now[0] = timestamp
+        button = gestures.update(axes) if gestures is not None else 0
+        layout.pack_into(report, axes, button)
+        latest[0] = bytes(report)
+        sent = detector.should_send(axes, button)
+        if args.print:
+            print(f"{timestamp:.4f} {'*' if sent else ' '} {button:04b} {axes} {list(report)}")
+
+    replay(recording, pipeline, on_frame, args.speed, imu)
+    check_reports(None)
+    print(f"Replayed: {detector.sent} reports would be sent, {detector.suppressed} suppressed "
+          f"(recorded session sent {len(recorded)})")
+    if compared[2]:
+        print(f"{compared[1]} of {compared[2]} recorded reports match the replayed frame")
+
+
+if __name__ == "__main__":
+    main()
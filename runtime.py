@@ -0,0 +1,369 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from scheduler import RateScheduler
+
+ERROR_LOG_EVERY = 100  # print one in N consecutive sensor errors
+REOPEN_AFTER_ERRORS = 3  # consecutive read errors before SPI is reopened
+REOPEN_MIN_BACKOFF = 0.05  # seconds before the next reopen, doubling per try
+REOPEN_MAX_BACKOFF = 2.0
+
+
+def dbus_call(method, *args):
+    """
+    Call a dbus-python proxy method asynchronously and return an asyncio
+    future for its reply. Replies are dispatched by the GLib main context
+    the event loop runs on, so the future is completed on the loop thread.
+    """
+    future = asyncio.get_running_loop().create_future()
+
+    def reply(*result):
+        if not future.done():
+            future.set_result(result[0] if len(result) == 1 else None)
+
+    def error(e):
+        if not future.done():
+            future.set_exception(e)
+
+    method(*args, reply_handler=reply, error_handler=error)
+    return future
+
+
+class GloveRuntime:
+    """
+    Event-loop runtime for one glove. Sampling and report emission are
+    tasks on the loop that dispatches D-Bus, so dbus-python objects are
+    only touched from one thread. The sampling task paces itself with
+    absolute deadlines and runs only the blocking SPI (and IMU FIFO) read
+    in the executor; each frame goes to the ring and wakes the report
+    task, which sends the newest frame to every input report and
+    conflates the rest, so a congested link never builds a queue.
+
+    Gloves sharing an SPI bus should share one executor and get
+    different phases. A failed read republishes the last frame, and
+    after REOPEN_AFTER_ERRORS in a row the device is reopened with a
+    doubling backoff; IMU errors only freeze the orientation and reopen
+    the IMU.
+    """
+    def __init__(self, pipeline, ring, input_report, rate_hz=100, report_interval=0.01,
+                 stats=None, profiles=None, profile_id=None, profile_save_frames=500,
+                 stats_interval_frames=0, rate_controller=None, idle_rate_hz=None,
+                 detail_reports=(), gestures=None, imu=None, executor=None, phase=None,
+                 loopback=None, record_flush_frames=100):
+        self.pipeline = pipeline
+        self.ring = ring
+        self.input_report = input_report
+        self.detail_reports = list(detail_reports)
+        self.gestures = gestures
+        self.imu = imu
+        self.loopback = loopback
+        self.report_interval = report_interval
+        self.rate_controller = rate_controller
+        self.rate_hz = rate_hz
+        self.idle_rate_hz = idle_rate_hz
+        self.stats = stats
+        self.profiles = profiles
+        self.profile_id = profile_id
+        self.profile_save_frames = profile_save_frames
+        self.stats_interval_frames = stats_interval_frames
+        self.record_flush_frames = record_flush_frames
+        self.scheduler = RateScheduler(idle_rate_hz or rate_hz, phase=phase)
+        # A shared executor belongs to whoever passed it in
+        self._owns_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="spi")
+        self.executor = executor
+
+        self.frame_ready = asyncio.Event()
+        self.stopping = asyncio.Event()
+        self.axes = [0] * ring.width
+        self.frame = [0] * ring.width
+        self._read_axes = [0] * ring.width
+        self._held = [0] * ring.width
+        self.button = 0
+        self.last_seq = 0
+        self.sent = 0
+        self.dropped = 0
+        self.errors = 0
+        self.reopens = 0
+        self.imu_errors = 0
+        self.imu_reopens = 0
+        self._imu_error_run = 0
+        self._imu_backoff = REOPEN_MIN_BACKOFF
+        self._imu_reopen_at = 0.0
+        self.emit_seconds = 0.0
+        self._error_run = 0
+        self._backoff = REOPEN_MIN_BACKOFF
+        self._reopen_at = 0.0
+        self._tasks = []
+        self.connected = set()
+
+        for report in [input_report] + self.detail_reports:
+            report.on_notify_changed = self.notify_changed
+            report.read_frame = self.latest_frame
+
+    def publish(self, axes, timestamp):
+        self.ring.write(axes, timestamp)
+        if self.loopback is not None:
+            self.loopback.write(axes, self.button, timestamp)
+        self.frame_ready.set()
+
+    def latest_frame(self):
+        """
+        The newest published frame and its buttons, for reads of the
+        input reports.
+        """
+        self.ring.read_latest(self._read_axes)
+        return self._read_axes, self.button
+
+    def read(self):
+        """
+        The blocking part of a frame: the SPI read, plus draining the IMU
+        FIFO if there is one.
+        """
+        raw = self.pipeline.sampler.read()
+        if self.imu is not None:
+            self.read_imu()
+        return raw
+
+    def read_imu(self):
+        """
+        Drain the IMU FIFO. Runs in the executor, after the flex read; an
+        IMU error only costs this frame's orientation update.
+        """
+        imu = self.imu
+        try:
+            imu.read()
+        except OSError as e:
+            imu.batch = b""
+            self.imu_errors += 1
+            self._imu_error_run += 1
+            if self._imu_error_run % ERROR_LOG_EVERY == 1:
+                print(f"IMU error ({self._imu_error_run} in a row): {e}")
+            now = time.monotonic()
+            if self._imu_error_run >= REOPEN_AFTER_ERRORS and now >= self._imu_reopen_at:
+                self.imu_reopens += 1
+                try:
+                    imu.imu.reopen()
+                except OSError as e:
+                    print("Reopening IMU failed:", e)
+                else:
+                    print(f"Reopened IMU after {self._imu_error_run} errors")
+                self._imu_reopen_at = now + self._imu_backoff
+                self._imu_backoff = min(self._imu_backoff * 2, REOPEN_MAX_BACKOFF)
+        else:
+            if self._imu_error_run:
+                self._imu_error_run = 0
+                self._imu_backoff = REOPEN_MIN_BACKOFF
+
+    def process_frame(self, raw, timestamp, start_ns):
+        axes = self.pipeline.transform(raw, timestamp)
+        if self.gestures is not None:
+            # Set before publishing so it always goes out with this frame
+            self.button = self.gestures.update(axes)
+        if self.imu is not None:
+            frame = self.frame
+            n = len(axes)
+            frame[:n] = axes
+            frame[n:] = self.imu.transform(self.imu.batch, timestamp)
+            axes = frame
+        self.publish(axes, timestamp)
+        if self.stats is not None:
+            self.stats.record("loop", start_ns)
+            self.stats.frame()
+
+    def hold_frame(self, timestamp):
+        """
+        Republish the newest frame after a failed read.
+        """
+        seq, _ = self.ring.read_latest(self._held)
+        if seq:
+            self.publish(self._held, timestamp)
+
+    def sample_once(self):
+        """
+        Read, process and publish one frame synchronously.
+        """
+        start = time.perf_counter_ns()
+        now = time.monotonic()
+        raw = self.read()
+        if self.stats is not None:
+            self.stats.record("adc", start)
+        self.process_frame(raw, now, start)
+
+    def send_latest(self):
+        """
+        Hand the newest frame to the input report if it has not been yet.
+        Returns True if there was a new frame; emit_seconds is how long
+        the emit took.
+        """
+        seq, timestamp = self.ring.read_latest(self.axes)
+        if seq == self.last_seq:
+            return False
+        if self.last_seq:
+            self.dropped += seq - self.last_seq - 1
+        self.last_seq = seq
+        start = time.perf_counter_ns()
+        if self.input_report.send_report(self.axes, self.button):
+            self.sent += 1
+        for report in self.detail_reports:
+            report.send_report(self.axes, self.button)
+        end = time.perf_counter_ns()
+        self.emit_seconds = (end - start) * 1e-9
+        if self.stats is not None:
+            self.stats.stage("emit").record(end - start)
+            self.stats.stage("age").record(int((time.monotonic() - timestamp) * 1e9))
+        return True
+
+    def report_stats(self):
+        """
+        Sent and suppressed counts of each input report's ChangeDetector,
+        by layout name.
+        """
+        return {report.layout.name: report.change_detector.stats()
+                for report in [self.input_report] + self.detail_reports
+                if report.change_detector is not None}
+
+    def notify_changed(self, notifying):
+        """
+        Called by an input report when a client subscribes or leaves.
+        A new subscriber gets the current frame right away, and sampling
+        runs at the active rate while any report has a subscriber.
+        """
+        if self.idle_rate_hz:
+            active = any(r.notifying for r in [self.input_report] + self.detail_reports)
+            self.scheduler.set_rate(self.rate_hz if active else self.idle_rate_hz)
+        if notifying:
+            self.last_seq = 0
+            self.frame_ready.set()
+
+    def device_changed(self, path, connected):
+        """
+        Called when a central connects or disconnects. BlueZ does not
+        always call StopNotify on a dropped link, so notifications are
+        switched off here once the last central is gone.
+        """
+        if connected:
+            self.connected.add(path)
+            print("Connected:", path)
+            if self.rate_controller is not None:
+                self.rate_controller.reset()
+            return
+        self.connected.discard(path)
+        print("Disconnected:", path)
+        if not self.connected:
+            for report in [self.input_report] + self.detail_reports:
+                if report.notifying:
+                    report.set_notifying(False)
+
+    def _sensor_error(self, e):
+        self.errors += 1
+        self._error_run += 1
+        if self._error_run % ERROR_LOG_EVERY == 1:
+            print(f"Sensor error ({self._error_run} in a row): {e}")
+
+    async def reopen_sampler(self):
+        """
+        Reopen the SPI device after repeated read errors. Tries are spaced
+        by a backoff that doubles until a read succeeds.
+        """
+        self.reopens += 1
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.pipeline.sampler.reopen)
+        except OSError as e:
+            print("Reopening SPI failed:", e)
+        else:
+            print(f"Reopened SPI after {self._error_run} errors")
+        self._reopen_at = time.monotonic() + self._backoff
+        self._backoff = min(self._backoff * 2, REOPEN_MAX_BACKOFF)
+
+    def _housekeeping(self):
+        frames = self.scheduler.frames
+        if frames == 0:
+            return
+        calibration = self.pipeline.calibration
+        if (self.profiles is not None and calibration.unsaved
+                and frames % self.profile_save_frames == 0):
+            self.profiles.save(self.profile_id, calibration)
+        recorder = self.pipeline.recorder
+        if recorder is not None and frames % self.record_flush_frames == 0:
+            recorder.flush()
+        if self.stats_interval_frames and frames % self.stats_interval_frames == 0:
+            print("Sensor loop:", self.scheduler.report())
+            if self.rate_controller is not None:
+                print("Reports:", self.rate_controller.stats())
+            changes = self.report_stats()
+            if changes:
+                print("Change detection:", changes)
+            if self.stats is not None:
+                print("Timings:", self.stats.report())
+            health = self.pipeline.health
+            if health is not None and not health.healthy():
+                print("Health:", health.snapshot())
+
+    async def sample_task(self):
+        loop = asyncio.get_running_loop()
+        read = self.read
+        self.scheduler.start()
+        while True:
+            start = time.perf_counter_ns()
+            now = time.monotonic()
+            try:
+                raw = await loop.run_in_executor(self.executor, read)
+                if self.stats is not None:
+                    self.stats.record("adc", start)
+                self.process_frame(raw, now, start)
+            except OSError as e:
+                self._sensor_error(e)
+                self.hold_frame(now)
+                if self._error_run >= REOPEN_AFTER_ERRORS and now >= self._reopen_at:
+                    await self.reopen_sampler()
+            else:
+                if self._error_run:
+                    self._error_run = 0
+                    self._backoff = REOPEN_MIN_BACKOFF
+            self._housekeeping()
+            await self.scheduler.wait_async()
+
+    async def report_task(self):
+        controller = self.rate_controller
+        while True:
+            await self.frame_ready.wait()
+            self.frame_ready.clear()
+            congested = self.input_report.congested
+            if not self.send_latest():
+                continue
+            if controller is not None:
+                controller.on_report(self.input_report.congested != congested, self.emit_seconds)
+                await asyncio.sleep(controller.interval)
+            elif self.report_interval > 0:
+                await asyncio.sleep(self.report_interval)
+
+    def _task_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Task {task.get_name()} failed:", repr(task.exception()))
+            self.stop()
+
+    async def run(self):
+        """
+        Run until stop() is called or a task fails, then cancel the tasks
+        and release the SPI executor if it is our own.
+        """
+        self._tasks = [
+            asyncio.create_task(self.sample_task(), name="sample"),
+            asyncio.create_task(self.report_task(), name="report"),
+        ]
+        for task in self._tasks:
+            task.add_done_callback(self._task_done)
+        try:
+            await self.stopping.wait()
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            if self._owns_executor:
+                self.executor.shutdown(wait=True)
+
+    def stop(self):
+        self.stopping.set()
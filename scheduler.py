@@ -0,0 +1,159 @@
+import asyncio
+import math
+import time
+
+
+class RateScheduler:
+    """
+    Fixed-rate scheduler driven by absolute deadlines on the monotonic clock.
+
+    Deadlines are computed as start + n * period, so time spent doing work
+    inside a frame never accumulates as drift. If a frame runs past one or
+    more whole deadlines, those frames are skipped instead of being run
+    back to back to catch up.
+
+    With a phase (0..1, a fraction of the period) deadlines are instead
+    pinned to a grid on the clock, at phase * period past each multiple
+    of the period. Schedulers at the same rate with different phases then
+    never fire together, whenever each was started.
+    """
+    def __init__(self, rate_hz=100, clock=time.monotonic, sleep=time.sleep, phase=None):
+        if rate_hz <= 0:
+            raise ValueError("rate_hz must be positive")
+        self.clock = clock
+        self.sleep = sleep
+        self.phase = phase
+        self.set_rate(rate_hz)
+        self.reset()
+
+    def set_rate(self, rate_hz):
+        """
+        Change the target rate. The next deadline is re-based on now so the
+        switch does not produce a burst or a long gap.
+        """
+        self.rate_hz = rate_hz
+        self.period = 1.0 / rate_hz
+        if getattr(self, "_start", None) is not None:
+            self._start = self._base(self.clock())
+            self._tick = 0
+            self._next = self._start + self.period
+
+    def reset(self):
+        self._start = None
+        self._tick = 0
+        self._next = None
+        self.frames = 0
+        self.overruns = 0
+        self.skipped = 0
+        self._first_wake = None
+        self._last_wake = None
+        # Welford running stats of wake-up lateness, in seconds
+        self._lat_n = 0
+        self._lat_mean = 0.0
+        self._lat_m2 = 0.0
+        self.max_lateness = 0.0
+
+    def _base(self, now):
+        """
+        Start of the current period: now, or the last grid point if phased.
+        """
+        if self.phase is None:
+            return now
+        return now - (now - self.phase * self.period) % self.period
+
+    def start(self):
+        now = self.clock()
+        self._start = self._base(now)
+        self._tick = 0
+        self._next = self._start + self.period
+        self._first_wake = now
+        self._last_wake = now
+
+    def wait(self):
+        """
+        Block until the next deadline and return the time it fired.
+        Call once per frame after the frame's work is done.
+        """
+        if self._start is None:
+            self.start()
+            return self._first_wake
+        delay = self._until_deadline()
+        if delay > 0:
+            self.sleep(delay)
+        return self._advance()
+
+    async def wait_async(self):
+        """
+        Same as wait(), but yields to the event loop instead of sleeping.
+        """
+        if self._start is None:
+            self.start()
+            return self._first_wake
+        delay = self._until_deadline()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return self._advance()
+
+    def _until_deadline(self):
+        """
+        Seconds left until the next deadline. If the frame overran, drop
+        the deadlines already missed and return 0.
+        """
+        now = self.clock()
+        if now < self._next:
+            return self._next - now
+        self.overruns += 1
+        missed = int((now - self._next) / self.period)
+        if missed:
+            self.skipped += missed
+            self._tick += missed
+            self._next += missed * self.period
+        return 0.0
+
+    def _advance(self):
+        now = self.clock()
+        self._record(now - self._next)
+        self._tick += 1
+        self._next = self._start + (self._tick + 1) * self.period
+        self.frames += 1
+        self._last_wake = now
+        return now
+
+    def _record(self, lateness):
+        self._lat_n += 1
+        delta = lateness - self._lat_mean
+        self._lat_mean += delta / self._lat_n
+        self._lat_m2 += delta * (lateness - self._lat_mean)
+        if lateness > self.max_lateness:
+            self.max_lateness = lateness
+
+    def achieved_rate(self):
+        if self.frames == 0 or self._last_wake == self._first_wake:
+            return 0.0
+        return self.frames / (self._last_wake - self._first_wake)
+
+    def jitter(self):
+        """
+        Standard deviation of wake-up lateness, in seconds.
+        """
+        if self._lat_n < 2:
+            return 0.0
+        return math.sqrt(self._lat_m2 / (self._lat_n - 1))
+
+    def stats(self):
+        return {
+            "target_hz": self.rate_hz,
+            "achieved_hz": self.achieved_rate(),
+            "frames": self.frames,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "jitter_ms": self.jitter() * 1000.0,
+            "mean_lateness_ms": self._lat_mean * 1000.0,
+            "max_lateness_ms": self.max_lateness * 1000.0,
+        }
+
+    def report(self):
+        s = self.stats()
+        return (f"rate {s['achieved_hz']:.1f}/{s['target_hz']} Hz, "
+                f"jitter {s['jitter_ms']:.2f} ms, max late {s['max_lateness_ms']:.2f} ms, "
+                f"overruns {s['overruns']}, skipped {s['skipped']}")
@@ -1,10 +1,63 @@
+import ctypes
+import fcntl
+import functools
 import spidev
 
+from calibration import ADC_BITS
+
+SPI_SPEED_HZ = 1350000
+FLEX_CHANNELS = (0, 1, 2, 3, 4)
+# SPI_IOC_MESSAGE encodes the descriptor array size in 14 bits
+MAX_TRANSFERS = ((1 << 14) - 1) // 32
+
+# linux/spi/spidev.h: SPI_IOC_MESSAGE(n) = _IOW('k', 0, char[n * sizeof(spi_ioc_transfer)])
+_IOC_WRITE = 1
+_SPI_IOC_MAGIC = ord("k")
+
+
+class SpiIocTransfer(ctypes.Structure):
+    _fields_ = [
+        ("tx_buf", ctypes.c_uint64),
+        ("rx_buf", ctypes.c_uint64),
+        ("len", ctypes.c_uint32),
+        ("speed_hz", ctypes.c_uint32),
+        ("delay_usecs", ctypes.c_uint16),
+        ("bits_per_word", ctypes.c_uint8),
+        ("cs_change", ctypes.c_uint8),
+        ("tx_nbits", ctypes.c_uint8),
+        ("rx_nbits", ctypes.c_uint8),
+        ("word_delay_usecs", ctypes.c_uint8),
+        ("pad", ctypes.c_uint8),
+    ]
+
+
+def spi_ioc_message(count):
+    size = count * ctypes.sizeof(SpiIocTransfer)
+    return (_IOC_WRITE << 30) | (size << 16) | (_SPI_IOC_MAGIC << 8)
+
+
 class MCP3008:
-    def __init__(self, bus=0, device=0):
+    def __init__(self, bus=0, device=0, max_speed_hz=SPI_SPEED_HZ):
+        self.bus = bus
+        self.device = device
+        self.max_speed_hz = max_speed_hz
+        self.spi = None
+        self.open()
+
+    def open(self):
         self.spi = spidev.SpiDev()
-        self.spi.open(bus, device)
-        self.spi.max_speed_hz = 1350000
+        self.spi.open(self.bus, self.device)
+        self.spi.max_speed_hz = self.max_speed_hz
+
+    def reopen(self):
+        """
+        Close and reopen the SPI device, to recover from a bus error.
+        """
+        try:
+            self.spi.close()
+        except OSError:
+            pass
+        self.open()
 
     def read_channel(self, channel):
         """
@@ -22,19 +75,178 @@ class MCP3008:
         self.spi.close()
 
 
-def read_flex_sensors():
+class FlexSampler:
+    """
+    Long-lived sampler that keeps the MCP3008 open and reads every
+    configured channel in a single SPI_IOC_MESSAGE per frame.
+
+    Each conversion is its own 3-byte spi_ioc_transfer with cs_change set,
+    so the MCP3008 still sees a CS edge between channels while the whole
+    frame costs one syscall. The command bytes, receive buffer and transfer
+    descriptors are built once; read() only refills self.raw in place.
+
+    With oversample=N each channel is converted N times back to back in
+    the same transfer and the results are decimated into one value with
+    log4(N) extra bits of resolution (N = 4 gives 11 bits, N = 16 gives 12).
+    resolution_bits tells the calibration how wide the values are.
+    """
+    def __init__(self, adc=None, channels=FLEX_CHANNELS, oversample=1):
+        for ch in channels:
+            if ch < 0 or ch > 7:
+                raise ValueError("Invalid channel, must be 0–7")
+        if oversample < 1:
+            raise ValueError("oversample must be at least 1")
+        n = len(channels) * oversample
+        if n > MAX_TRANSFERS:
+            raise ValueError(f"At most {MAX_TRANSFERS} conversions per frame")
+        self.adc = adc if adc is not None else MCP3008()
+        self.channels = tuple(channels)
+        self.oversample = oversample
+        self.resolution_bits = self.resolution_for(oversample)
+        self.extra_bits = self.resolution_bits - ADC_BITS
+        self.raw = [0] * len(self.channels)
+
+        self.tx_buffer = (ctypes.c_uint8 * (3 * n))()
+        self.rx_buffer = (ctypes.c_uint8 * (3 * n))()
+        for i, ch in enumerate(self.channels):
+            for k in range(oversample):
+                j = 3 * (i * oversample + k)
+                self.tx_buffer[j] = 1
+                self.tx_buffer[j + 1] = (8 + ch) << 4
+
+        self._transfers = (SpiIocTransfer * n)()
+        tx_base = ctypes.addressof(self.tx_buffer)
+        rx_base = ctypes.addressof(self.rx_buffer)
+        for i in range(n):
+            xfer = self._transfers[i]
+            xfer.tx_buf = tx_base + 3 * i
+            xfer.rx_buf = rx_base + 3 * i
+            xfer.len = 3
+            xfer.speed_hz = self.adc.max_speed_hz
+            xfer.bits_per_word = 8
+            # Release CS between conversions, but not after the last one
+            xfer.cs_change = 1 if i < n - 1 else 0
+        self._request = spi_ioc_message(n)
+        self._message = self._batch_message()
+
+    @staticmethod
+    def resolution_for(oversample):
+        """
+        Bits per value after decimating oversample conversions.
+        """
+        extra = 0
+        while 4 ** (extra + 1) <= oversample:
+            extra += 1
+        return ADC_BITS + extra
+
+    @property
+    def conversions_per_frame(self):
+        return len(self.channels) * self.oversample
+
+    def sample_rate(self, frame_rate):
+        """
+        ADC conversions per second at the given frame rate.
+        """
+        return self.conversions_per_frame * frame_rate
+
+    def _batch_message(self):
+        """
+        Return a callable that runs the whole frame's transfers, or None
+        if only per-channel xfer2 is available.
+        """
+        spi = self.adc.spi
+        try:
+            fd = spi.fileno()
+        except (AttributeError, OSError):
+            # Older spidev without fileno(): fall back to per-channel xfer2
+            return None
+        return functools.partial(fcntl.ioctl, fd, self._request, self._transfers)
+
+    def read(self):
+        """
+        Read all channels into self.raw and return it. Values are
+        0 – 2**resolution_bits - 1; the returned list is reused on every call.
+        """
+        raw = self.raw
+        n = self.oversample
+        extra = self.extra_bits
+        if self._message is None:
+            for i, ch in enumerate(self.channels):
+                total = 0
+                for _ in range(n):
+                    total += self.adc.read_channel(ch)
+                raw[i] = (total << extra) // n
+            return raw
+
+        self._message()
+        rx = self.rx_buffer
+        if n == 1:
+            for i in range(len(raw)):
+                raw[i] = ((rx[3 * i + 1] & 3) << 8) | rx[3 * i + 2]
+            return raw
+        for i in range(len(raw)):
+            total = 0
+            for j in range(3 * n * i, 3 * n * (i + 1), 3):
+                total += ((rx[j + 1] & 3) << 8) | rx[j + 2]
+            raw[i] = (total << extra) // n
+        return raw
+
+    def reopen(self):
+        """
+        Reopen the ADC's SPI device. The batched message holds the old
+        file descriptor, so it is rebuilt.
+        """
+        self.adc.reopen()
+        self._message = self._batch_message()
+
+    def close(self):
+        self.adc.close()
+
+
+class MultiSampler:
     """
-    Reads 5 flex sensors on CH0–CH4, scales to -32768 - 32767.
+    Several FlexSamplers (one per MCP3008) read as one, for gloves with
+    more than 8 channels. Values are concatenated in sampler order.
+    channels are the global indices, so a second ADC's channel 0 is 8.
     """
-    raw_min = 200
-    raw_max = 400
-    mcp = MCP3008()
-    values = []
-    for ch in range(5):
-        raw = mcp.read_channel(ch)
-        # Scale to -32768 - 32767 range
-        scaled = int((raw - raw_min) * 65535 / (raw_max - raw_min) - 32768)
-        scaled = max(-32768, min(32767, scaled))  # clamp
-        values.append(scaled)
-    mcp.close()
-    return values
\ No newline at end of file
+    def __init__(self, samplers):
+        if not samplers:
+            raise ValueError("MultiSampler needs at least one sampler")
+        if len({s.resolution_bits for s in samplers}) != 1:
+            raise ValueError("All samplers must have the same resolution")
+        self.samplers = list(samplers)
+        self.oversample = samplers[0].oversample
+        self.resolution_bits = samplers[0].resolution_bits
+        self.channels = tuple(8 * i + ch for i, s in enumerate(samplers) for ch in s.channels)
+        self.raw = [0] * len(self.channels)
+        # (start, end) of each sampler's values in a frame
+        self.groups = []
+        start = 0
+        for s in self.samplers:
+            self.groups.append((start, start + len(s.channels)))
+            start += len(s.channels)
+
+    @property
+    def conversions_per_frame(self):
+        return sum(s.conversions_per_frame for s in self.samplers)
+
+    def sample_rate(self, frame_rate):
+        return self.conversions_per_frame * frame_rate
+
+    def read(self):
+        raw = self.raw
+        i = 0
+        for sampler in self.samplers:
+            values = sampler.read()
+            raw[i:i + len(values)] = values
+            i += len(values)
+        return raw
+
+    def reopen(self):
+        for sampler in self.samplers:
+            sampler.reopen()
+
+    def close(self):
+        for sampler in self.samplers:
+            sampler.close()
+
@@ -0,0 +1,490 @@
+"""
+Hardware-free backends for benchmarking on an ordinary Linux box.
+
+install() registers simulated spidev, smbus2, dbus and gi modules in
+sys.modules, and wraps fcntl.ioctl for the simulated SPI devices, so
+sensors.py, imu.py, gatt_server.py and main.py run unchanged. The SPI side answers MCP3008 commands from a waveform, the I2C
+side serves an MPU-6050 FIFO from a motion source, and the D-Bus side
+delivers signals to a StubBus that captures PropertiesChanged emits
+instead of sending them.
+"""
+import asyncio
+import ctypes
+import fcntl
+import math
+import os
+import random
+import sys
+import time
+import types
+
+ADC_MAX = 1023
+FAKE_FD_BASE = 1 << 20  # above any real descriptor, so ioctl can tell them apart
+
+
+class SyntheticWaveform:
+    """
+    Deterministic finger-like motion: each channel bends slowly between
+    raw 200 and 400 at its own frequency, with a little ADC noise.
+    faults maps a channel to a fixed raw value it reads instead, e.g. 0
+    for an unplugged sensor; it can be changed while running.
+    """
+    def __init__(self, rate_hz=100, seed=1, noise=2, faults=None):
+        self.rate_hz = rate_hz
+        self.noise = noise
+        self.random = random.Random(seed)
+        self.faults = dict(faults or {})
+
+    def sample(self, channel, frame):
+        if channel in self.faults:
+            return self.faults[channel]
+        t = frame / self.rate_hz
+        value = 300 + 100 * math.sin(2 * math.pi * (0.3 + 0.17 * channel) * t + channel)
+        value += self.random.randint(-self.noise, self.noise)
+        return max(0, min(ADC_MAX, int(value)))
+
+
+class RecordedWaveform:
+    """
+    Replays recorded raw frames (sequences of per-channel 10-bit values),
+    looping at the end. channels maps ADC channel -> index in a frame.
+    """
+    def __init__(self, frames, channels=(0, 1, 2, 3, 4)):
+        if not frames:
+            raise ValueError("No frames to replay")
+        self.frames = frames
+        self.channel_index = {ch: i for i, ch in enumerate(channels)}
+
+    @classmethod
+    def from_recording(cls, path, channels=(0, 1, 2, 3, 4)):
+        """
+        Replay the raw frames of a recording.Recorder file, reduced to
+        the MCP3008's native 10 bits.
+        """
+        from recording import Recording
+        recording = Recording(path)
+        shift = recording.resolution_bits - 10
+        frames = [[v >> shift for v in values] for _, values in recording.frames]
+        return cls(frames, channels[:recording.channels])
+
+    def sample(self, channel, frame):
+        index = self.channel_index.get(channel)
+        if index is None:
+            return 0
+        return self.frames[frame % len(self.frames)][index]
+
+
+class FakeSpiDev:
+    """
+    Stand-in for spidev.SpiDev wired to an MCP3008 that reads from a
+    waveform. An open device has a fake fileno(); the fcntl.ioctl that
+    install() puts in place hands SPI_IOC_MESSAGE on it to message(),
+    which serves the descriptor array the way the kernel would and
+    advances one frame per call. xfer2() advances one frame per
+    conversion of channel 0.
+    """
+    waveform = None  # shared default, set by install()
+    devices = {}  # fake file descriptor -> open device
+    _next_fd = FAKE_FD_BASE
+
+    def __init__(self, waveform=None):
+        self.waveform = waveform if waveform is not None else FakeSpiDev.waveform
+        if self.waveform is None:
+            self.waveform = SyntheticWaveform()
+        self.max_speed_hz = 0
+        self.frame = 0
+        self.conversions = 0
+        self.opened = False
+        self.fd = None
+
+    def open(self, bus, device):
+        self.bus = bus
+        self.device = device
+        self.opened = True
+        self.fd = FakeSpiDev._next_fd
+        FakeSpiDev._next_fd += 1
+        FakeSpiDev.devices[self.fd] = self
+
+    def close(self):
+        self.opened = False
+        FakeSpiDev.devices.pop(self.fd, None)
+        self.fd = None
+
+    def fileno(self):
+        if not self.opened:
+            raise OSError("SPI device not open")
+        return self.fd
+
+    def _convert(self, command):
+        if len(command) < 3 or command[0] != 1:
+            return bytes(len(command))
+        channel = (command[1] >> 4) & 7
+        value = self.waveform.sample(channel, self.frame)
+        self.conversions += 1
+        return bytes([0, (value >> 8) & 3, value & 0xFF])
+
+    def xfer2(self, data):
+        if not self.opened:
+            raise OSError("SPI device not open")
+        channel = (data[1] >> 4) & 7
+        if channel == 0 and self.conversions:
+            self.frame += 1
+        return list(self._convert(bytes(data)))
+
+    def message(self, transfers):
+        if not self.opened:
+            raise OSError("SPI device not open")
+        for xfer in transfers:
+            command = ctypes.string_at(xfer.tx_buf, xfer.len)
+            reply = self._convert(command)
+            ctypes.memmove(xfer.rx_buf, reply, xfer.len)
+        self.frame += 1
+
+
+def fake_ioctl(real_ioctl):
+    """
+    fcntl.ioctl that runs SPI_IOC_MESSAGE on a FakeSpiDev's descriptor
+    and passes anything else to the real one.
+    """
+    def ioctl(fd, request, arg=0, mutate_flag=True):
+        device = FakeSpiDev.devices.get(fd)
+        if device is None:
+            return real_ioctl(fd, request, arg, mutate_flag)
+        from sensors import SpiIocTransfer
+        count = ((request >> 16) & 0x3FFF) // ctypes.sizeof(SpiIocTransfer)
+        device.message((SpiIocTransfer * count).from_buffer(arg))
+        return 0
+    return ioctl
+
+
+class SyntheticMotion:
+    """
+    Deterministic hand motion for the IMU: roll, pitch and yaw swing
+    slowly, and sample() returns the matching accelerometer reading (g)
+    and body rates (deg/s), with a little noise.
+    """
+    def __init__(self, seed=1, noise=0.002):
+        self.noise = noise
+        self.random = random.Random(seed)
+
+    def angles(self, t):
+        roll = 0.6 * math.sin(2 * math.pi * 0.2 * t)
+        pitch = 0.4 * math.sin(2 * math.pi * 0.13 * t + 1.0)
+        yaw = 0.8 * math.sin(2 * math.pi * 0.07 * t)
+        return roll, pitch, yaw
+
+    def sample(self, t, dt):
+        roll, pitch, yaw = self.angles(t)
+        r1, p1, y1 = self.angles(t + dt)
+        droll, dpitch, dyaw = (r1 - roll) / dt, (p1 - pitch) / dt, (y1 - yaw) / dt
+        sr, cr = math.sin(roll), math.cos(roll)
+        sp, cp = math.sin(pitch), math.cos(pitch)
+        accel = (-sp, sr * cp, cr * cp)
+        gyro = (droll - dyaw * sp,
+                dpitch * cr + dyaw * sr * cp,
+                -dpitch * sr + dyaw * cr * cp)
+        n = self.noise
+        accel = [a + self.random.uniform(-n, n) for a in accel]
+        gyro = [math.degrees(g) + self.random.uniform(-50 * n, 50 * n) for g in gyro]
+        return accel, gyro
+
+
+class RecordedMotion:
+    """
+    Replays the raw FIFO batches of a recording.Recorder file, looping at
+    the end. Batches are served whole, as they were read on the glove.
+    """
+    def __init__(self, batches):
+        if not batches:
+            raise ValueError("No IMU batches to replay")
+        self.batches = batches
+        self.index = 0
+
+    @classmethod
+    def from_recording(cls, path):
+        from recording import Recording
+        return cls([batch for _, batch in Recording(path).imu])
+
+    def next_batch(self):
+        batch = self.batches[self.index % len(self.batches)]
+        self.index += 1
+        return batch
+
+
+class FakeMpu6050:
+    """
+    MPU-6050 register file and FIFO. Every FIFO count query makes
+    samples_per_read new samples available, so a frame-paced caller
+    sees the batch size it would at the configured rates.
+    """
+    motion = None  # shared default, set by install()
+
+    def __init__(self, motion=None, samples_per_read=2):
+        from imu import ACCEL_RANGES, GYRO_RANGES, INTERNAL_RATE_HZ
+        self.motion = motion if motion is not None else FakeMpu6050.motion
+        if self.motion is None:
+            self.motion = SyntheticMotion()
+        self.samples_per_read = samples_per_read
+        self.registers = bytearray(128)
+        self.registers[0x75] = 0x68
+        self.fifo = bytearray()
+        self.sample_index = 0
+        self.selected = 0
+        self.accel_lsb = {bits: lsb for bits, lsb in ACCEL_RANGES.values()}
+        self.gyro_lsb = {bits: lsb for bits, lsb in GYRO_RANGES.values()}
+        self.internal_rate = INTERNAL_RATE_HZ
+
+    def write(self, data):
+        from imu import USER_CTRL, USER_CTRL_FIFO_RESET
+        self.selected = data[0]
+        if len(data) > 1:
+            self.registers[self.selected] = data[1]
+            if self.selected == USER_CTRL and data[1] & USER_CTRL_FIFO_RESET:
+                self.fifo.clear()
+
+    def read(self, length):
+        from imu import FIFO_COUNT_H, FIFO_R_W, FIFO_SIZE
+        if self.selected == FIFO_COUNT_H:
+            self._produce()
+            count = min(len(self.fifo), FIFO_SIZE)
+            return bytes([count >> 8, count & 0xFF])[:length]
+        if self.selected == FIFO_R_W:
+            data = bytes(self.fifo[:length])
+            del self.fifo[:length]
+            return data + bytes(length - len(data))
+        return bytes(self.registers[self.selected:self.selected + length])
+
+    def _produce(self):
+        from imu import SAMPLE
+        if hasattr(self.motion, "next_batch"):
+            self.fifo += self.motion.next_batch()
+            return
+        rate = self.internal_rate / (self.registers[0x19] + 1)
+        accel_lsb = self.accel_lsb[self.registers[0x1C]]
+        gyro_lsb = self.gyro_lsb[self.registers[0x1B]]
+        for _ in range(self.samples_per_read):
+            accel, gyro = self.motion.sample(self.sample_index / rate, 1.0 / rate)
+            self.sample_index += 1
+            values = [max(-32768, min(32767, int(a * accel_lsb))) for a in accel]
+            values += [max(-32768, min(32767, int(g * gyro_lsb))) for g in gyro]
+            self.fifo += SAMPLE.pack(*values)
+
+
+class FakeI2cMsg:
+    def __init__(self, addr, data=None, length=0):
+        self.addr = addr
+        self.data = bytes(data) if data is not None else b""
+        self.len = len(self.data) if data is not None else length
+        self.is_read = data is None
+
+    @classmethod
+    def write(cls, addr, data):
+        return cls(addr, data)
+
+    @classmethod
+    def read(cls, addr, length):
+        return cls(addr, None, length)
+
+    def __bytes__(self):
+        return self.data
+
+
+class FakeSMBus:
+    """
+    Stand-in for smbus2.SMBus with one FakeMpu6050 at every address.
+    """
+    def __init__(self, bus=None):
+        self.bus = bus
+        self.devices = {}
+
+    def i2c_rdwr(self, *messages):
+        for msg in messages:
+            device = self.devices.get(msg.addr)
+            if device is None:
+                device = self.devices[msg.addr] = FakeMpu6050()
+            if msg.is_read:
+                msg.data = device.read(msg.len)
+            else:
+                device.write(msg.data)
+
+    def close(self):
+        pass
+
+
+class StubBus:
+    """
+    Captures signals emitted by simulated dbus.service.Objects. Keeps
+    counts and the last value rather than every message.
+    """
+    def __init__(self, keep=0):
+        self.keep = keep
+        self.emits = 0
+        self.bytes = 0
+        self.last_value = None
+        self.last_time = 0.0
+        self.captured = []
+
+    def get_object(self, bus_name, path):
+        return (bus_name, path)
+
+    def add_signal_receiver(self, handler, **kwargs):
+        pass
+
+    def emit_signal(self, path, interface, member, args):
+        if member != "PropertiesChanged":
+            return
+        value = args[1].get("Value")
+        if value is not None:
+            # Stands in for marshalling the payload into a D-Bus message
+            value = bytes(value)
+            self.bytes += len(value)
+        self.emits += 1
+        self.last_value = value
+        self.last_time = time.monotonic()
+        if len(self.captured) < self.keep:
+            self.captured.append((self.last_time, path, value))
+
+
+def _make_dbus():
+    dbus = types.ModuleType("dbus")
+
+    class Array(list):
+        def __init__(self, items=(), signature=None):
+            super().__init__(items)
+            self.signature = signature
+
+    class Dictionary(dict):
+        def __init__(self, items=(), signature=None):
+            super().__init__(items)
+            self.signature = signature
+
+    class ByteArray(bytes):
+        pass
+
+    class ObjectPath(str):
+        pass
+
+    class Interface:
+        def __init__(self, obj, interface):
+            self.obj = obj
+            self.interface = interface
+
+        def __getattr__(self, name):
+            def call(*args, reply_handler=None, error_handler=None, **kwargs):
+                # BlueZ calls succeed immediately, with no return value
+                if reply_handler is not None:
+                    reply_handler()
+            return call
+
+    dbus.Array = Array
+    dbus.ByteArray = ByteArray
+    dbus.ObjectPath = ObjectPath
+    dbus.Interface = Interface
+    dbus.Boolean = bool
+    dbus.Byte = int
+    dbus.UInt16 = int
+    dbus.UInt32 = int
+    dbus.String = str
+    dbus.Dictionary = Dictionary
+    dbus.SystemBus = StubBus
+    # Like dbus.types.UnixFd, takes its own duplicate of the descriptor
+    dbus.types = types.SimpleNamespace(UnixFd=lambda f: os.dup(f if isinstance(f, int) else f.fileno()))
+
+    exceptions = types.ModuleType("dbus.exceptions")
+
+    class DBusException(Exception):
+        pass
+
+    exceptions.DBusException = DBusException
+    dbus.exceptions = exceptions
+
+    service = types.ModuleType("dbus.service")
+
+    class Object:
+        def __init__(self, conn=None, object_path=None, bus_name=None):
+            self._sim_conn = conn
+            self._object_path = object_path
+
+        def remove_from_connection(self, connection=None, path=None):
+            self._sim_conn = None
+
+    def method(dbus_interface, in_signature=None, out_signature=None, **kwargs):
+        return lambda func: func
+
+    def signal(dbus_interface, signature=None, **kwargs):
+        def decorator(func):
+            member = func.__name__
+
+            def emit(self, *args):
+                func(self, *args)
+                conn = getattr(self, "_sim_conn", None)
+                if conn is not None and hasattr(conn, "emit_signal"):
+                    conn.emit_signal(self._object_path, dbus_interface, member, args)
+            emit.__name__ = member
+            return emit
+        return decorator
+
+    service.Object = Object
+    service.method = method
+    service.signal = signal
+    dbus.service = service
+
+    mainloop = types.ModuleType("dbus.mainloop")
+    glib = types.ModuleType("dbus.mainloop.glib")
+    glib.DBusGMainLoop = lambda set_as_default=False: None
+    mainloop.glib = glib
+    dbus.mainloop = mainloop
+
+    return {"dbus": dbus, "dbus.service": service, "dbus.exceptions": exceptions,
+            "dbus.mainloop": mainloop, "dbus.mainloop.glib": glib}
+
+
+def _make_gi():
+    gi = types.ModuleType("gi")
+    repository = types.ModuleType("gi.repository")
+    glib = types.ModuleType("gi.repository.GLib")
+    glib.timeouts = []
+
+    def timeout_add(interval_ms, callback, *args):
+        glib.timeouts.append((interval_ms, callback, args))
+        return len(glib.timeouts)
+
+    class MainLoop:
+        def run(self):
+            raise RuntimeError("No GLib main loop in the simulator")
+
+        def quit(self):
+            pass
+
+    glib.timeout_add = timeout_add
+    glib.MainLoop = MainLoop
+    repository.GLib = glib
+    gi.repository = repository
+
+    events = types.ModuleType("gi.events")
+    events.GLibEventLoopPolicy = asyncio.DefaultEventLoopPolicy
+    gi.events = events
+    return {"gi": gi, "gi.repository": repository, "gi.repository.GLib": glib,
+            "gi.events": events}
+
+
+def install(waveform=None, motion=None):
+    """
+    Register the simulated modules. Must run before importing sensors,
+    gatt_server or main. Returns the simulated spidev module.
+    """
+    spidev = types.ModuleType("spidev")
+    spidev.SpiDev = FakeSpiDev
+    FakeSpiDev.waveform = waveform
+    if not getattr(fcntl.ioctl, "simulated", False):
+        fcntl.ioctl = fake_ioctl(fcntl.ioctl)
+        fcntl.ioctl.simulated = True
+    smbus2 = types.ModuleType("smbus2")
+    smbus2.SMBus = FakeSMBus
+    smbus2.i2c_msg = FakeI2cMsg
+    FakeMpu6050.motion = motion
+    modules = {"spidev": spidev, "smbus2": smbus2}
+    modules.update(_make_dbus())
+    modules.update(_make_gi())
+    sys.modules.update(modules)
+    return spidev